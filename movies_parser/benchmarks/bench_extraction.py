@@ -0,0 +1,301 @@
+"""Offline benchmark of the extraction pipeline on recorded HTML fixtures.
+
+Replays saved Wikipedia category/movie pages and IMDb pages through the spider
+callbacks as fake HtmlResponse objects (no network), checks the produced items
+against fixtures/expected.json and compares timings with baseline.json.
+The category page is also run through the API engine (EXTRACTION_ENGINE =
+"api") with recorded MediaWiki / Wikidata JSON responses.
+
+    python benchmarks/bench_extraction.py                    # run and compare
+    python benchmarks/bench_extraction.py --update-baseline  # store new baseline
+    python benchmarks/bench_extraction.py --pool 1,2,4       # parse pool scaling
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+FIXTURES_DIR = BENCH_DIR / "fixtures"
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+EXPECTED_PATH = FIXTURES_DIR / "expected.json"
+
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from scrapy.http import HtmlResponse  # noqa: E402
+from scrapy.http import Request  # noqa: E402
+from scrapy.http import TextResponse  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from movies_parser.infobox import Infobox  # noqa: E402
+from movies_parser.spiders import movies  # noqa: E402
+from movies_parser.writers import typed_row  # noqa: E402
+
+SETTINGS = {
+    "IMDB_CACHE_ENABLED": False,
+    "CRAWL_STATE_FILE": None,
+    "CATEGORY_SHARDS": 0,
+    "SEEN_TITLES_PATH": ":memory:",
+    # Фикстура без инфобокса должна сразу разбираться, а не уходить на повтор
+    "RETRY_POLICY_BUDGETS": {"missing_infobox": 0},
+    "RETRY_DEAD_LETTER_FILE": None,
+}
+
+CATEGORY_URL = "https://ru.wikipedia.org/wiki/Категория:Фильмы_по_алфавиту"
+MOVIE_FIXTURES = ["movie_full", "movie_imdb_id", "movie_multiple_dates", "movie_no_infobox"]
+
+# Какой фикстурой отвечать на запросы к IMDb и API
+ROUTES = {
+    "imdb.com/find/": "imdb_search",
+    "imdb.com/title/": "imdb_title",
+    "ru.wikipedia.org/w/api.php": "api_pageprops",
+    "props=claims": "wikidata_entities",
+    "props=labels": "wikidata_labels",
+}
+
+
+def load_fixture(name):
+    return (FIXTURES_DIR / f"{name}.html").read_bytes()
+
+
+def make_response(url, body, request):
+    if body.startswith(b"{"):
+        return TextResponse(url=url, body=body, encoding="utf-8", request=request)
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=request)
+
+
+def make_spider(**settings):
+    crawler = get_crawler(movies.MoviesSpider, {**SETTINGS, **settings})
+    return movies.MoviesSpider.from_crawler(crawler)
+
+
+class Replay:
+    """Прогоняет запросы через колбэки паука, отвечая фикстурами, и замеряет время колбэков."""
+
+    def __init__(self, spider, fixtures):
+        self.spider = spider
+        self.fixtures = fixtures
+        self.timings = {}
+        self.requests = 0
+
+    def route(self, url):
+        return next((name for pattern, name in ROUTES.items() if pattern in url), None)
+
+    def call(self, request, body):
+        callback = request.callback or self.spider.parse
+        response = make_response(request.url, body, request)
+        self.requests += 1
+        started = time.perf_counter()
+        output = list(callback(response, **request.cb_kwargs) or [])
+        elapsed = time.perf_counter() - started
+        self.timings.setdefault(callback.__name__, []).append(elapsed)
+        return output
+
+    def run(self, request, body, follow_imdb=True):
+        """Выполняет запрос и всю цепочку после него, возвращает готовые фильмы.
+
+        Без follow_imdb фильм считается готовым, как только запрошен его рейтинг.
+        """
+        items = []
+        queue = [(request, body)]
+        while queue:
+            request, body = queue.pop()
+            for result in self.call(request, body):
+                if isinstance(result, Request):
+                    name = self.route(result.url)
+                    if name and name.startswith("imdb_") and not follow_imdb:
+                        items.append(output_fields(result.cb_kwargs["movie"]))
+                    elif name:
+                        queue.append((result, self.fixtures[name]))
+                else:
+                    items.append(output_fields(result))
+        return items
+
+
+def output_fields(item):
+    """Только поля, которые попадают в файл результатов (без revid и времени рейтинга), с типами как в JSON lines."""
+    return typed_row(item)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, round(q / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def run_api(replay):
+    """Страница категории через API-движок: фильмы и число запросов к API."""
+    replay.spider.wikidata_labels.clear()
+    replay.requests = 0
+    category_request = Request(CATEGORY_URL, callback=replay.spider.parse)
+    items = replay.run(category_request, replay.fixtures["category"], follow_imdb=False)
+    return items, replay.requests - 1
+
+
+def run_once(replay):
+    """Один проход по корпусу: страница категории и все страницы фильмов с цепочкой IMDb."""
+    fixtures = replay.fixtures
+    category_request = Request(CATEGORY_URL, callback=replay.spider.parse)
+    replay.call(category_request, fixtures["category"])
+
+    items = {}
+    for name in MOVIE_FIXTURES:
+        url = f"https://ru.wikipedia.org/wiki/{name}"
+        request = Request(url, callback=replay.spider.parse_movie)
+        items[name] = replay.run(request, fixtures[name])
+
+    # Отдельно: разбор уже построенного инфобокса (микробенчмарк Infobox)
+    for name in MOVIE_FIXTURES:
+        response = make_response(f"https://ru.wikipedia.org/wiki/{name}", fixtures[name], None)
+        table = response.css("table.infobox")
+        if table:
+            started = time.perf_counter()
+            infobox = Infobox.from_selector(table[0])
+            movies.get_original_title(name, infobox)
+            for label in ("Жанр", "Стран", "Режиссёр"):
+                movies.get_list_from_infobox(label, infobox)
+            for label in movies.YEAR_LABELS:
+                movies.get_infobox_value(label, infobox)
+            movies.get_infobox_imdb_link(infobox)
+            replay.timings.setdefault("infobox", []).append(time.perf_counter() - started)
+    return items
+
+
+def benchmark(iterations):
+    fixtures = {path.stem: path.read_bytes() for path in FIXTURES_DIR.glob("*.*")
+                if path.suffix in (".html", ".json") and path != EXPECTED_PATH}
+    spider = make_spider()
+
+    # Пиковая память — отдельным проходом, tracemalloc замедляет замеры времени
+    tracemalloc.start()
+    items = run_once(Replay(spider, fixtures))
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    replay = Replay(spider, fixtures)
+    pages = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        run_once(replay)
+        pages += 1 + len(MOVIE_FIXTURES)
+    elapsed = time.perf_counter() - started
+
+    api_replay = Replay(make_spider(EXTRACTION_ENGINE="api"), fixtures)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        api_items, api_requests = run_api(api_replay)
+    api_elapsed = time.perf_counter() - started
+    items["api_category"] = sorted(api_items, key=lambda item: item["title"])
+    replay.timings.update(api_replay.timings)
+
+    callbacks = {
+        name: {
+            "calls": len(values),
+            "p50_ms": round(statistics.median(values) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+        for name, values in sorted(replay.timings.items())
+    }
+    return items, {
+        "pages_per_sec": round(pages / elapsed, 1),
+        "peak_memory_mb": round(peak_mb, 2),
+        "api_movies_per_sec": round(len(api_items) * iterations / api_elapsed, 1),
+        "api_requests_per_movie": round(api_requests / len(api_items), 3),
+        "callbacks": callbacks,
+    }
+
+
+def pool_scaling(workers_list, pages_per_worker=50):
+    """Статей в секунду при разборе в пуле из N процессов (как с PARSE_POOL_WORKERS = N)."""
+    urls = [f"https://ru.wikipedia.org/wiki/{name}" for name in MOVIE_FIXTURES]
+    bodies = [load_fixture(name) for name in MOVIE_FIXTURES]
+    expected = [movies.extract_movie(make_response(url, body, None)) for url, body in zip(urls, bodies)]
+
+    results = {}
+    for workers in workers_list:
+        count = pages_per_worker * workers
+        jobs = [(bodies[i % len(bodies)], urls[i % len(urls)], "utf-8") for i in range(count)]
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            # Прогрев: запуск процессов и импорт паука в каждом из них
+            list(executor.map(movies.extract_movie_from_body, *zip(*jobs[:workers])))
+            started = time.perf_counter()
+            output = list(executor.map(movies.extract_movie_from_body, *zip(*jobs), chunksize=4))
+            elapsed = time.perf_counter() - started
+        if output[:len(expected)] != expected:
+            raise AssertionError("пул процессов вернул не то же, что разбор в основном процессе")
+        results[workers] = round(count / elapsed, 1)
+    return results
+
+
+def check_items(items):
+    """Сравнивает извлечённые фильмы с эталоном, возвращает список расхождений."""
+    expected = json.loads(EXPECTED_PATH.read_text(encoding="utf-8"))
+    return [
+        f"{name}: ожидалось {expected.get(name)}, получено {got}"
+        for name, got in items.items()
+        if expected.get(name) != got
+    ]
+
+
+def compare(result, baseline, tolerance):
+    """Возвращает список регрессий относительно базовых замеров."""
+    regressions = []
+    if result["pages_per_sec"] * tolerance < baseline["pages_per_sec"]:
+        regressions.append(f"pages/sec: {result['pages_per_sec']} (база {baseline['pages_per_sec']})")
+    for name, stats in result["callbacks"].items():
+        base = baseline["callbacks"].get(name)
+        if base and stats["p50_ms"] > base["p50_ms"] * tolerance:
+            regressions.append(f"{name} p50: {stats['p50_ms']} мс (база {base['p50_ms']} мс)")
+    if "api_movies_per_sec" in baseline and result["api_movies_per_sec"] * tolerance < baseline["api_movies_per_sec"]:
+        regressions.append(f"API movies/sec: {result['api_movies_per_sec']} (база {baseline['api_movies_per_sec']})")
+    if result["peak_memory_mb"] > baseline["peak_memory_mb"] * tolerance:
+        regressions.append(f"peak memory: {result['peak_memory_mb']} МБ (база {baseline['peak_memory_mb']} МБ)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=1.5, help="допустимое замедление относительно базы")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--update-expected", action="store_true", help="перезаписать эталонные фильмы")
+    parser.add_argument("--pool", help="замерить пул разбора для списка числа процессов, например 1,2,4")
+    args = parser.parse_args()
+
+    if args.pool:
+        print(f"parse pool, {os.cpu_count()} CPU:")
+        for workers, pages_per_sec in pool_scaling(int(workers) for workers in args.pool.split(",")).items():
+            print(f"  workers={workers:<3} pages/sec={pages_per_sec}")
+        return 0
+
+    items, result = benchmark(args.iterations)
+
+    print(f"pages/sec: {result['pages_per_sec']}, peak memory: {result['peak_memory_mb']} MB")
+    print(f"API engine: {result['api_movies_per_sec']} movies/sec, "
+          f"{result['api_requests_per_movie']} requests per movie (HTML engine: 1 article per movie)")
+    for name, stats in result["callbacks"].items():
+        print(f"  {name:<20} calls={stats['calls']:<5} p50={stats['p50_ms']:.3f} ms  p99={stats['p99_ms']:.3f} ms")
+
+    if args.update_expected:
+        EXPECTED_PATH.write_text(json.dumps(items, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    problems = check_items(items)
+
+    if args.update_baseline:
+        BASELINE_PATH.write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+        print(f"Базовые замеры сохранены в {BASELINE_PATH}")
+    elif BASELINE_PATH.exists():
+        problems += compare(result, json.loads(BASELINE_PATH.read_text(encoding="utf-8")), args.tolerance)
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
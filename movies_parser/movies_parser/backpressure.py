@@ -0,0 +1,135 @@
+# Memory-bounded category crawl
+#
+# A category page lists up to 200 movies and is read much faster than their
+# articles and IMDb pages are fetched, so without a limit the scheduler, the
+# downloader and the items in progress grow with the category. CrawlBackpressure
+# puts the movie URLs of a category page into a disk queue (queuelib) and turns
+# them into requests only while fewer than CRAWL_MAX_PENDING_REQUESTS requests
+# wait in the scheduler or are being downloaded or parsed, at most
+# CATEGORY_PAGE_MOVIE_REQUESTS per category page. The next category page is
+# requested only when the disk queue is empty, the crawl is below that limit
+# and the process RSS is below CRAWL_MEMORY_CEILING_MB; otherwise it is held
+# and scheduled when finished movies bring the crawl under
+# CRAWL_RESUME_PENDING_REQUESTS, or when the engine runs out of work.
+import os
+import resource
+import shutil
+import tempfile
+
+from queuelib import FifoDiskQueue
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса, МБ (ru_maxrss в Linux - в килобайтах)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    """Текущий RSS процесса, МБ; без /proc - пиковый."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+class CrawlBackpressure:
+    def __init__(self, crawler, request_factory, max_pending=1000, resume_pending=250, page_requests=50,
+                 memory_ceiling_mb=0, queue_dir=None):
+        self.crawler = crawler
+        # URL страницы фильма -> запрос (у паука)
+        self.request_factory = request_factory
+        self.max_pending = max_pending
+        self.resume_pending = min(resume_pending, max_pending)
+        self.page_requests = page_requests
+        self.memory_ceiling_mb = memory_ceiling_mb
+        self.queue_dir = tempfile.mkdtemp(prefix="movies-queue-", dir=queue_dir)
+        self.queue = FifoDiskQueue(os.path.join(self.queue_dir, "movies"))
+        # Отложенные запросы следующих страниц категории (по одному на фронтир)
+        self.held_pages = []
+
+    @classmethod
+    def from_crawler(cls, crawler, request_factory):
+        settings = crawler.settings
+        backpressure = cls(
+            crawler,
+            request_factory,
+            max_pending=settings.getint("CRAWL_MAX_PENDING_REQUESTS"),
+            resume_pending=settings.getint("CRAWL_RESUME_PENDING_REQUESTS", 250),
+            page_requests=settings.getint("CATEGORY_PAGE_MOVIE_REQUESTS", 50),
+            memory_ceiling_mb=settings.getint("CRAWL_MEMORY_CEILING_MB"),
+            queue_dir=settings.get("CRAWL_QUEUE_DIR"),
+        )
+        crawler.signals.connect(backpressure.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(backpressure.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(backpressure.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(backpressure.close, signal=signals.spider_closed)
+        return backpressure
+
+    def pending(self):
+        """Запросы в планировщике, в загрузчике и ответы, которые ещё разбираются."""
+        engine = self.crawler.engine
+        if engine.slot is None:
+            return 0
+        pending = len(engine.slot.scheduler) + len(engine.downloader.active) + len(engine.scraper.slot.active)
+        self.crawler.stats.max_value("backpressure/max_pending", pending)
+        return pending
+
+    def over_memory(self):
+        """RSS выше CRAWL_MEMORY_CEILING_MB; заодно обновляет memory/peak_rss_mb."""
+        self.crawler.stats.max_value("memory/peak_rss_mb", round(peak_rss_mb()))
+        return bool(self.memory_ceiling_mb) and rss_mb() >= self.memory_ceiling_mb
+
+    def push(self, url):
+        self.queue.push(url.encode())
+        self.crawler.stats.inc_value("backpressure/queued")
+
+    def requests(self, limit):
+        """Запросы фильмов из очереди на диске: не больше limit и пока не достигнут CRAWL_MAX_PENDING_REQUESTS."""
+        released = 0
+        while released < limit and len(self.queue) and self.pending() < self.max_pending:
+            released += 1
+            self.crawler.stats.inc_value("backpressure/released")
+            yield self.request_factory(self.queue.pop().decode())
+
+    def next_page(self, request):
+        """Запрос следующей страницы категории, или None, если страница отложена."""
+        if len(self.queue) or self.pending() >= self.max_pending or self.over_memory():
+            self.held_pages.append(request)
+            self.crawler.stats.inc_value("backpressure/pages_held")
+            return None
+        return request
+
+    def resume(self, force=False):
+        """Дозапрашивает фильмы из очереди, а когда она пуста - отложенные страницы категории.
+
+        Без force - только если обход ниже CRAWL_RESUME_PENDING_REQUESTS и
+        памяти хватает; True, если что-то запрошено.
+        """
+        if not force and (self.pending() >= self.resume_pending or self.over_memory()):
+            return False
+        engine = self.crawler.engine
+        scheduled = False
+        for request in self.requests(self.max_pending):
+            engine.crawl(request)
+            scheduled = True
+        while self.held_pages and not len(self.queue) and (force or self.pending() < self.max_pending):
+            engine.crawl(self.held_pages.pop(0))
+            scheduled = True
+        return scheduled
+
+    def item_done(self, item):
+        self.resume()
+
+    def spider_idle(self):
+        # Работы нет: продолжаем даже выше потолка памяти, иначе обход закончится раньше времени
+        if self.over_memory() and (len(self.queue) or self.held_pages):
+            self.crawler.stats.inc_value("backpressure/memory_ceiling_overrides")
+        if self.resume(force=True):
+            raise DontCloseSpider
+
+    def close(self):
+        self.queue.close()
+        shutil.rmtree(self.queue_dir, ignore_errors=True)
@@ -0,0 +1,115 @@
+# Parallel traversal of the category by alphabet shards
+#
+# The category is split into N frontiers: frontier 0 starts at the first
+# category page, frontier i starts at ?pagefrom=<boundary i>. Each frontier
+# follows "next page" links until the next page's pagefrom= cursor reaches the
+# boundary of the following frontier, so all frontiers paginate concurrently.
+# Boundaries split the expected number of titles evenly (SHARD_WEIGHTS: few
+# titles start with digits or Latin letters, most with a handful of Cyrillic
+# letters) or are given explicitly with CATEGORY_SHARD_BOUNDARIES.
+import urllib.parse
+
+# Порядок первых символов ключей сортировки, одинаковый для сортировок MediaWiki
+# "uppercase" и "uca-ru": цифры, затем латиница, затем кириллица.
+# Ё и Й сортируются по-разному в этих вариантах, поэтому в границы не входят и
+# при сравнении считаются неизвестными символами.
+SHARD_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZАБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+
+# Примерная доля названий категории (в процентах), начинающихся с символа: по частоте
+# первых букв русских слов, цифры и латиница - единицы процентов на всех
+SHARD_WEIGHTS = {
+    **dict.fromkeys("0123456789", 0.1),
+    **dict.fromkeys("ABCDEFGHIJKLMNOPQRSTUVWXYZ", 0.15),
+    "А": 4.5, "Б": 5.2, "В": 6.6, "Г": 3.4, "Д": 5.2, "Е": 0.7, "Ж": 1.0, "З": 3.6, "И": 3.4,
+    "К": 8.4, "Л": 3.4, "М": 6.1, "Н": 6.0, "О": 5.3, "П": 11.8, "Р": 4.5, "С": 9.9, "Т": 4.3,
+    "У": 2.3, "Ф": 2.1, "Х": 2.0, "Ц": 0.6, "Ч": 2.0, "Ш": 1.8, "Щ": 0.2, "Ъ": 0.01, "Ы": 0.01,
+    "Ь": 0.01, "Э": 1.3, "Ю": 0.5, "Я": 1.1,
+}
+
+
+def shard_boundaries(count):
+    """Начальные символы фронтиров 1..count-1 (фронтир 0 начинается с начала).
+
+    Границы делят поровну ожидаемое число названий (SHARD_WEIGHTS), а не алфавит:
+    иначе почти вся кириллическая категория попадает в один-два фронтира.
+    """
+    count = min(count, len(SHARD_ALPHABET))
+    # Доля названий до каждого символа алфавита
+    before = [0.0]
+    for char in SHARD_ALPHABET[:-1]:
+        before.append(before[-1] + SHARD_WEIGHTS[char])
+    total = before[-1] + SHARD_WEIGHTS[SHARD_ALPHABET[-1]]
+
+    boundaries = []
+    index = 0
+    for i in range(1, count):
+        # Граница ближе всего к i/count названий, но правее предыдущей и с местом для оставшихся
+        candidates = range(index + 1, len(SHARD_ALPHABET) - (count - 1 - i))
+        index = min(candidates, key=lambda j: abs(before[j] - i * total / count))
+        boundaries.append(SHARD_ALPHABET[index])
+    return boundaries
+
+
+def check_boundaries(boundaries):
+    """Проверяет границы из CATEGORY_SHARD_BOUNDARIES: символы SHARD_ALPHABET по возрастанию."""
+    for boundary in boundaries:
+        if len(boundary) != 1 or boundary not in SHARD_ALPHABET[1:]:
+            raise ValueError(f"Граница фронтира - один символ SHARD_ALPHABET, кроме первого: {boundary!r}")
+    positions = [SHARD_ALPHABET.index(boundary) for boundary in boundaries]
+    if positions != sorted(set(positions)):
+        raise ValueError(f"Границы фронтиров должны идти по алфавиту без повторов: {boundaries}")
+    return list(boundaries)
+
+
+def shard_start_url(category_url, prefix):
+    """URL страницы категории, начинающейся с prefix."""
+    category = urllib.parse.unquote(category_url.rsplit("/wiki/", 1)[-1])
+    query = urllib.parse.urlencode({"title": category, "pagefrom": prefix})
+    return f"https://ru.wikipedia.org/w/index.php?{query}"
+
+
+def page_cursor(url):
+    """Возвращает (ключ сортировки, название) из параметра pagefrom ссылки на страницу категории."""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    cursor = query.get("pagefrom", [""])[0]
+    sortkey, _, title = cursor.partition("\n")
+    return sortkey, title or sortkey
+
+
+def reached_boundary(sortkey, boundary):
+    """Дошёл ли фронтир до начала следующего. Неизвестные символы не останавливают обход:
+    лишняя страница лишь повторит ссылки, которые отфильтрует дедупликация."""
+    first = sortkey[:1].upper()
+    if first not in SHARD_ALPHABET:
+        return False
+    return SHARD_ALPHABET.index(first) >= SHARD_ALPHABET.index(boundary)
+
+
+class ShardCoverage:
+    """Проверяет, что на стыках фронтиров не потеряны фильмы.
+
+    Фронтир i-1 останавливается перед страницей, которая начинается с названия X
+    (из курсора pagefrom). X не дальше одной страницы от границы, поэтому должно
+    встретиться на первой странице фронтира i, иначе между фронтирами есть разрыв.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        # Фронтир -> названия на его первой странице
+        self.first_pages = {}
+        # Фронтир -> название, перед которым он остановился
+        self.stop_titles = {}
+
+    def first_page(self, frontier, titles):
+        self.first_pages.setdefault(frontier, set(titles))
+
+    def stopped(self, frontier, title):
+        self.stop_titles[frontier] = title
+
+    def gaps(self):
+        """Номера фронтиров, перед которыми возможен разрыв."""
+        return [
+            frontier for frontier in range(1, self.count)
+            if frontier - 1 in self.stop_titles and frontier in self.first_pages
+            and self.stop_titles[frontier - 1] not in self.first_pages[frontier]
+        ]
@@ -0,0 +1,169 @@
+# Adaptive per-domain concurrency
+#
+# Wikipedia, Wikidata and IMDb have different rate limits and latencies, so
+# every download slot (one per host) gets its own concurrency window, tuned
+# AIMD-style like TCP congestion control. A response that comes back under the
+# slot's target latency while the window is in use grows the window by
+# 1/window, i.e. by one request per window of responses. A 429/503, or an
+# average latency above the target, shrinks it by ADAPTIVE_CONCURRENCY_BACKOFF,
+# at most once per round trip. SlotAwarePriorityQueue hands a request out only
+# when its slot has room in the window, so requests waiting for a narrow IMDb
+# window stay in the scheduler instead of taking CONCURRENT_REQUESTS places
+# away from Wikipedia.
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.pqueues import DownloaderAwarePriorityQueue
+
+# Вес нового замера в скользящем среднем задержки
+EWMA_ALPHA = 0.3
+
+
+class ConcurrencyWindow:
+    __slots__ = ("size", "minimum", "maximum", "target_latency", "latency", "decreased_at")
+
+    def __init__(self, start=4, minimum=1, maximum=16, target_latency=3.0):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.size = float(min(max(start, self.minimum), self.maximum))
+        self.target_latency = target_latency
+        # Скользящее среднее задержки ответа, с
+        self.latency = None
+        self.decreased_at = float("-inf")
+
+    @property
+    def concurrency(self):
+        return int(self.size)
+
+    def observe(self, latency):
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+
+    def congested(self):
+        return self.latency is not None and self.latency > self.target_latency
+
+    def increase(self):
+        """Аддитивное увеличение; True, если изменилось число одновременных запросов."""
+        before = self.concurrency
+        self.size = min(self.size + 1 / self.size, self.maximum)
+        return self.concurrency != before
+
+    def decrease(self, factor, now):
+        """Мультипликативное уменьшение, не чаще раза за время ответа; True, если окно уменьшено."""
+        # Ответы на запросы, отправленные до прошлого уменьшения, о новом окне ничего не говорят
+        if now - self.decreased_at < (self.latency or 0) or self.size <= self.minimum:
+            return False
+        self.decreased_at = now
+        self.size = max(self.size * factor, self.minimum)
+        return True
+
+
+class AdaptiveConcurrencyMiddleware:
+    """Подстраивает число одновременных запросов к каждому домену по задержкам и ответам 429/503.
+
+    Окно применяется к слоту загрузчика и к DOWNLOAD_SLOTS, так что слот,
+    пересозданный после простоя, начинает с текущего окна.
+    """
+
+    def __init__(self, crawler, domains, defaults, backoff=0.5, throttle_codes=(429, 503)):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.domains = domains
+        self.defaults = defaults
+        self.backoff = backoff
+        self.throttle_codes = set(throttle_codes)
+        self.windows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        middleware = cls(
+            crawler,
+            domains=settings.getdict("ADAPTIVE_CONCURRENCY_DOMAINS"),
+            defaults=settings.getdict("ADAPTIVE_CONCURRENCY_DEFAULT"),
+            backoff=settings.getfloat("ADAPTIVE_CONCURRENCY_BACKOFF", 0.5),
+            throttle_codes=[int(code) for code in settings.getlist("ADAPTIVE_CONCURRENCY_THROTTLE_CODES")],
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def window(self, key):
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = ConcurrencyWindow(**{**self.defaults, **self.domains.get(key, {})})
+        return window
+
+    def apply(self, key, window):
+        downloader = self.crawler.engine.downloader
+        downloader.per_slot_settings[key] = {**downloader.per_slot_settings.get(key, {}),
+                                             "concurrency": window.concurrency}
+        slot = downloader.slots.get(key)
+        if slot is not None:
+            slot.concurrency = window.concurrency
+        self.stats.set_value(f"concurrency/{key}/window", window.concurrency)
+        self.stats.max_value(f"concurrency/{key}/max_window", window.concurrency)
+        self.stats.min_value(f"concurrency/{key}/min_window", window.concurrency)
+
+    def in_use(self, key, window):
+        # Окно растёт, только если оно заполнено: медленный поток запросов ничего не говорит о пределе сайта
+        slot = self.crawler.engine.downloader.slots.get(key)
+        return slot is not None and len(slot.transferring) + 1 >= window.concurrency
+
+    def process_response(self, request, response, spider):
+        key = request.meta.get("download_slot")
+        latency = request.meta.get("download_latency")
+        # Ответы из HTTP-кэша не загружались
+        if key is None or latency is None or "cached" in response.flags:
+            return response
+
+        window = self.window(key)
+        window.observe(latency)
+        if response.status in self.throttle_codes or window.congested():
+            if response.status in self.throttle_codes:
+                self.stats.inc_value(f"concurrency/{key}/throttled")
+            if window.decrease(self.backoff, time.monotonic()):
+                self.stats.inc_value(f"concurrency/{key}/decreases")
+                self.apply(key, window)
+        elif self.in_use(key, window) and window.increase():
+            self.apply(key, window)
+        return response
+
+    def spider_opened(self, spider):
+        for key in self.domains:
+            self.apply(key, self.window(key))
+
+
+class SlotAwarePriorityQueue(DownloaderAwarePriorityQueue):
+    """Очередь приоритетов по слотам загрузчика (SCHEDULER_PRIORITY_QUEUE).
+
+    Запрос выдаётся только слоту, у которого есть место в окне, из таких слотов
+    выбирается наименее загруженный относительно окна, а в слоте - запрос с
+    наибольшим приоритетом. Если свободных слотов нет, движок ждёт окончания
+    загрузки, а запросы остаются в планировщике.
+    """
+
+    def next_slot(self):
+        slots = self.crawler.engine.downloader.slots
+        best_load, best_key = None, None
+        for key in self.pqueues:
+            slot = slots.get(key)
+            load = len(slot.active) / max(slot.concurrency, 1) if slot is not None else 0.0
+            if load < 1 and (best_load is None or load < best_load):
+                best_load, best_key = load, key
+        return best_key
+
+    def pop(self):
+        key = self.next_slot()
+        if key is None:
+            return None
+        queue = self.pqueues[key]
+        request = queue.pop()
+        if len(queue) == 0:
+            del self.pqueues[key]
+        return request
+
+    def peek(self):
+        key = self.next_slot()
+        return self.pqueues[key].peek() if key is not None else None
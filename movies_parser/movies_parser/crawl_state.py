@@ -0,0 +1,75 @@
+# Crash-safe checkpoint of the category crawl frontier
+#
+# After every category page the spider stores the next page URL of each
+# category frontier (the pagefrom= cursor) and the movie URLs that were
+# requested but have not produced an item yet. A restarted crawl resumes from
+# this state instead of walking the category from page 1 again. The first page
+# of every frontier is stored as its cursor before the crawl starts, so a shard
+# whose first page was never parsed is not lost on resume.
+import json
+import os
+from pathlib import Path
+
+
+class CrawlState:
+    def __init__(self, path):
+        self.path = Path(path)
+        # Номер фронтира -> URL следующей страницы категории (None, если фронтир пройден)
+        self.cursors = {}
+        # URL страниц фильмов, запрошенных, но ещё не сохранённых (dict сохраняет порядок)
+        self.pending = {}
+        # Название фильма -> URL его страницы, пока ждём рейтинг IMDb
+        self.titles = {}
+
+        if self.path.exists():
+            state = json.loads(self.path.read_text(encoding="utf-8"))
+            self.cursors = state.get("cursors", {})
+            self.pending = dict.fromkeys(state.get("pending", []))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("CRAWL_STATE_FILE"))
+
+    def resumable(self):
+        """Есть ли незавершённый обход: не пройден фронтир или остались несохранённые фильмы."""
+        return bool(self.pending) or any(self.cursors.values())
+
+    def add_pending(self, url):
+        self.pending[url] = None
+
+    def movie_parsed(self, url, title):
+        """Страница фильма разобрана, фильм ждёт рейтинга."""
+        if url in self.pending:
+            self.titles[title] = url
+
+    def movie_done(self, title):
+        """Фильм сохранён или отброшен пайплайном."""
+        url = self.titles.pop(title, None)
+        if url:
+            self.pending.pop(url, None)
+
+    def movie_failed(self, url):
+        """Фильм не будет сохранён (повторы исчерпаны или ошибка в колбэке), он остаётся только в dead-letter."""
+        self.pending.pop(url, None)
+        for title in [title for title, title_url in self.titles.items() if title_url == url]:
+            del self.titles[title]
+
+    def set_cursor(self, frontier, url):
+        self.cursors[str(frontier)] = url
+
+    def save(self):
+        """Атомарно записывает состояние: временный файл, затем переименование."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        state = {"cursors": self.cursors, "pending": list(self.pending)}
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(self.path)
+
+    def close(self, reason):
+        """Сохраняет состояние; завершённый обход удаляет файл, следующий запуск начнётся с начала."""
+        if reason == "finished":
+            self.path.unlink(missing_ok=True)
+        else:
+            self.save()
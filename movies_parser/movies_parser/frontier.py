@@ -0,0 +1,415 @@
+# Shared frontier for crawling on several nodes
+#
+# SharedScheduler keeps Wikipedia category and article requests (callbacks
+# listed in FRONTIER_CALLBACKS) in a frontier shared by all nodes instead of
+# the in-process queue; IMDb and API follow-ups of a parsed article stay in the
+# local Scrapy queues of the node that parsed it. The frontier is also the
+# shared dupefilter: a request fingerprint is queued once for all nodes.
+#
+# A node claims a request with a lease of FRONTIER_LEASE_SECONDS. The lease is
+# released (acked) once the response has been parsed and its follow-up
+# requests pushed, or when the download failed; retries put the request back
+# into the queue. Leases of a node that died expire and the requests are
+# claimed by others, at most FRONTIER_MAX_CLAIMS times in a row.
+#
+# Requests that must be fetched again although their fingerprint was seen
+# (dont_filter, dead-letter replays, incremental re-fetches of changed
+# articles) put a finished or abandoned entry back into the queue; an entry
+# that is still queued or leased is not touched.
+#
+# Backends: a SQLite file (locking is done by SQLite itself, so all nodes must
+# see the file on a local or lock-capable shared file system) and Redis.
+import os
+import pickle
+import socket
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.core.scheduler import Scheduler
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+
+try:
+    import redis
+except ImportError:  # redis нужен только для FRONTIER_URL = "redis://..."
+    redis = None
+
+QUEUED = 0
+LEASED = 1
+DONE = 2
+FAILED = 3
+
+REDIS_SCHEMES = ("redis://", "rediss://", "unix://")
+
+
+def node_name(settings):
+    """Имя узла в арендах: FRONTIER_NODE или хост и PID процесса."""
+    return settings.get("FRONTIER_NODE") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shared_scheduler_enabled(settings):
+    # Не issubclass: BaseScheduler в Scrapy проверяет подклассы по наличию методов, и под него
+    # подходит любой планировщик, в том числе стандартный
+    return SharedScheduler in load_object(settings["SCHEDULER"]).__mro__
+
+
+def open_frontier(settings):
+    url = settings.get("FRONTIER_URL", "frontier.sqlite")
+    lease_seconds = settings.getfloat("FRONTIER_LEASE_SECONDS", 600)
+    max_claims = settings.getint("FRONTIER_MAX_CLAIMS", 3)
+    if url.startswith(REDIS_SCHEMES):
+        if redis is None:
+            raise ImportError("Для FRONTIER_URL = 'redis://...' установите redis: pip install redis")
+        return RedisFrontier(redis.Redis.from_url(url), settings.get("FRONTIER_REDIS_PREFIX", "movies:frontier"),
+                             lease_seconds, max_claims)
+    return SqliteFrontier(url.removeprefix("sqlite:///"), lease_seconds, max_claims)
+
+
+class SqliteFrontier:
+    """Фронтир в файле SQLite; узлы разбирают запросы в транзакциях BEGIN IMMEDIATE."""
+
+    def __init__(self, path, lease_seconds=600, max_claims=3):
+        self.lease_seconds = lease_seconds
+        self.max_claims = max_claims
+        # Транзакции открываются явно; timeout - ожидание блокировки файла, которую держит другой узел
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        # WAL требует общей памяти и не работает на сетевых файловых системах
+        self.db.execute("PRAGMA journal_mode = DELETE")
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS frontier (
+                fingerprint BLOB PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                request BLOB NOT NULL,
+                state INTEGER NOT NULL DEFAULT {QUEUED},
+                node TEXT,
+                lease_until REAL,
+                claims INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, priority DESC);
+        """)
+
+    def push(self, fingerprint, request, priority):
+        """Добавляет запрос, если его отпечатка ещё нет во фронтире; True, если добавлен."""
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO frontier (fingerprint, priority, request) VALUES (?, ?, ?)",
+            (fingerprint, priority, request),
+        )
+        return cursor.rowcount == 1
+
+    def requeue(self, fingerprint, request, priority):
+        """Возвращает запрос в очередь (повтор или перенаправление) с новым содержимым."""
+        self.db.execute(
+            f"UPDATE frontier SET request = ?, priority = ?, state = {QUEUED}, node = NULL, lease_until = NULL, "
+            "claims = 0 WHERE fingerprint = ?",
+            (request, priority, fingerprint),
+        )
+
+    def reset(self, fingerprint, request, priority):
+        """Возвращает в очередь завершённый или брошенный запрос; True, если он был таким."""
+        return self.db.execute(
+            f"UPDATE frontier SET request = ?, priority = ?, state = {QUEUED}, node = NULL, lease_until = NULL, "
+            f"claims = 0 WHERE fingerprint = ? AND state IN ({DONE}, {FAILED})",
+            (request, priority, fingerprint),
+        ).rowcount == 1
+
+    def claim(self, node):
+        """Берёт в аренду запрос с наибольшим приоритетом.
+
+        Просроченные аренды сначала возвращаются в очередь; запросы, аренда которых
+        истекла FRONTIER_MAX_CLAIMS раз подряд, помечаются как неудавшиеся.
+        Возвращает (аренда, число возвращённых, число брошенных), где аренда -
+        (отпечаток, запрос, номер аренды) или None, если очередь пуста.
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            failed = self.db.execute(
+                f"UPDATE frontier SET state = {FAILED} WHERE state = {LEASED} AND lease_until < ? AND claims >= ?",
+                (now, self.max_claims),
+            ).rowcount
+            expired = self.db.execute(
+                f"UPDATE frontier SET state = {QUEUED} WHERE state = {LEASED} AND lease_until < ?", (now,),
+            ).rowcount
+            row = self.db.execute(
+                f"SELECT fingerprint, request, claims FROM frontier WHERE state = {QUEUED} "
+                "ORDER BY priority DESC LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    f"UPDATE frontier SET state = {LEASED}, node = ?, lease_until = ?, claims = claims + 1 "
+                    "WHERE fingerprint = ?",
+                    (node, now + self.lease_seconds, row[0]),
+                )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        claimed = (row[0], row[1], row[2] + 1) if row is not None else None
+        return claimed, expired, failed
+
+    def ack(self, fingerprint, node, claims):
+        """Завершает аренду, если она всё ещё принадлежит узлу; True, если завершена."""
+        return self.db.execute(
+            f"UPDATE frontier SET state = {DONE}, lease_until = NULL "
+            f"WHERE fingerprint = ? AND state = {LEASED} AND node = ? AND claims = ?",
+            (fingerprint, node, claims),
+        ).rowcount == 1
+
+    def pending(self):
+        """Есть запросы в очереди или в аренде (в том числе у других узлов)."""
+        return self.db.execute(
+            f"SELECT EXISTS (SELECT 1 FROM frontier WHERE state IN ({QUEUED}, {LEASED}))"
+        ).fetchone()[0] == 1
+
+    def queued(self):
+        return self.db.execute(f"SELECT COUNT(*) FROM frontier WHERE state = {QUEUED}").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class RedisFrontier:
+    """Фронтир в Redis: множество отпечатков, очередь и аренды - сортированные множества."""
+
+    def __init__(self, client, prefix="movies:frontier", lease_seconds=600, max_claims=3):
+        self.client = client
+        self.lease_seconds = lease_seconds
+        self.max_claims = max_claims
+        # Все отпечатки, когда-либо попавшие во фронтир (общий фильтр дубликатов)
+        self.seen_key = f"{prefix}:seen"
+        # Отпечаток -> сериализованный запрос, пока запрос не завершён
+        self.requests_key = f"{prefix}:requests"
+        self.priorities_key = f"{prefix}:priorities"
+        # Очередь: отпечаток со счётом -priority; аренды: отпечаток со счётом lease_until
+        self.queue_key = f"{prefix}:queue"
+        self.leases_key = f"{prefix}:leases"
+        # Отпечаток -> "узел номер_аренды"
+        self.owners_key = f"{prefix}:owners"
+        self.failed_key = f"{prefix}:failed"
+
+    def push(self, fingerprint, request, priority):
+        if not self.client.sadd(self.seen_key, fingerprint):
+            return False
+        pipe = self.client.pipeline()
+        pipe.hset(self.requests_key, fingerprint, request)
+        pipe.hset(self.priorities_key, fingerprint, priority)
+        pipe.zadd(self.queue_key, {fingerprint: -priority})
+        pipe.execute()
+        return True
+
+    def requeue(self, fingerprint, request, priority):
+        pipe = self.client.pipeline()
+        self.queue_commands(pipe, fingerprint, request, priority)
+        pipe.execute()
+
+    def queue_commands(self, pipe, fingerprint, request, priority):
+        pipe.hset(self.requests_key, fingerprint, request)
+        pipe.hset(self.priorities_key, fingerprint, priority)
+        pipe.hdel(self.owners_key, fingerprint)
+        pipe.zrem(self.leases_key, fingerprint)
+        pipe.zadd(self.queue_key, {fingerprint: -priority})
+
+    def reset(self, fingerprint, request, priority):
+        def reset(pipe):
+            if (pipe.zscore(self.queue_key, fingerprint) is not None
+                    or pipe.zscore(self.leases_key, fingerprint) is not None):
+                return False
+            pipe.multi()
+            pipe.srem(self.failed_key, fingerprint)
+            self.queue_commands(pipe, fingerprint, request, priority)
+            return True
+
+        return self.client.transaction(reset, self.queue_key, self.leases_key, value_from_callable=True)
+
+    def claim(self, node):
+        # Каждый шаг - транзакция WATCH/MULTI: узел, упавший посреди шага, не оставляет запрос ни в
+        # очереди, ни в аренде; если другой узел изменил очередь или аренды, шаг повторяется
+        now = time.time()
+        expired = failed = 0
+        for fingerprint in self.client.zrangebyscore(self.leases_key, "-inf", now):
+            state = self.client.transaction(
+                lambda pipe, fingerprint=fingerprint: self.expire_lease(pipe, fingerprint, now),
+                self.leases_key,
+                value_from_callable=True,
+            )
+            expired += state == QUEUED
+            failed += state == FAILED
+
+        claimed = []
+
+        def lease(pipe):
+            claimed.clear()
+            head = pipe.zrange(self.queue_key, 0, 0)
+            if not head:
+                return
+            fingerprint = head[0]
+            owner = pipe.hget(self.owners_key, fingerprint)
+            claims = (int(owner.split()[-1]) if owner else 0) + 1
+            pipe.multi()
+            pipe.zrem(self.queue_key, fingerprint)
+            pipe.hset(self.owners_key, fingerprint, f"{node} {claims}")
+            pipe.zadd(self.leases_key, {fingerprint: now + self.lease_seconds})
+            pipe.hget(self.requests_key, fingerprint)
+            claimed.extend((fingerprint, claims))
+
+        results = self.client.transaction(lease, self.queue_key)
+        if not claimed:
+            return None, expired, failed
+        fingerprint, claims = claimed
+        return (fingerprint, results[-1], claims), expired, failed
+
+    def expire_lease(self, pipe, fingerprint, now):
+        """Возвращает просроченную аренду в очередь (QUEUED) или бросает запрос (FAILED); None, если её уже нет."""
+        lease_until = pipe.zscore(self.leases_key, fingerprint)
+        if lease_until is None or lease_until > now:
+            return None
+        owner = pipe.hget(self.owners_key, fingerprint)
+        claims = int(owner.split()[-1]) if owner else 0
+        priority = int(pipe.hget(self.priorities_key, fingerprint) or 0)
+        pipe.multi()
+        pipe.zrem(self.leases_key, fingerprint)
+        if claims >= self.max_claims:
+            pipe.sadd(self.failed_key, fingerprint)
+            return FAILED
+        pipe.zadd(self.queue_key, {fingerprint: -priority})
+        return QUEUED
+
+    def ack(self, fingerprint, node, claims):
+        owner = self.client.hget(self.owners_key, fingerprint)
+        if owner is None or owner.decode() != f"{node} {claims}":
+            return False
+        if not self.client.zrem(self.leases_key, fingerprint):
+            return False
+        pipe = self.client.pipeline()
+        pipe.hdel(self.requests_key, fingerprint)
+        pipe.hdel(self.priorities_key, fingerprint)
+        pipe.hdel(self.owners_key, fingerprint)
+        pipe.execute()
+        return True
+
+    def pending(self):
+        return self.client.zcard(self.queue_key) + self.client.zcard(self.leases_key) > 0
+
+    def queued(self):
+        return self.client.zcard(self.queue_key)
+
+    def close(self):
+        self.client.close()
+
+
+class SharedScheduler(Scheduler):
+    """Планировщик Scrapy, который делит запросы категории и статей с другими узлами через фронтир."""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        scheduler.frontier = open_frontier(crawler.settings)
+        scheduler.node = node_name(crawler.settings)
+        scheduler.shared_callbacks = set(crawler.settings.getlist("FRONTIER_CALLBACKS", ["parse", "parse_movie"]))
+        return scheduler
+
+    def open(self, spider):
+        spider.logger.info(f"Общий фронтир: узел {self.node}, в очереди {self.frontier.queued()} запросов")
+        return super().open(spider)
+
+    def close(self, reason):
+        self.frontier.close()
+        return super().close(reason)
+
+    def is_shared(self, request):
+        return getattr(request.callback, "__name__", "parse") in self.shared_callbacks
+
+    def has_pending_requests(self):
+        # Аренды других узлов тоже считаются: если узел упадёт, его запросы достанутся этому
+        return super().has_pending_requests() or self.frontier.pending()
+
+    def enqueue_request(self, request):
+        if not self.is_shared(request):
+            return super().enqueue_request(request)
+
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=pickle.HIGHEST_PROTOCOL)
+        lease = request.meta.get("frontier_lease")
+        if lease:
+            # Повтор или перенаправление арендованного запроса: обновляем ту же запись фронтира
+            self.frontier.requeue(lease[0], data, request.priority)
+            self.stats.inc_value("frontier/requeued", spider=self.spider)
+            return True
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request)
+        if self.frontier.push(fingerprint, data, request.priority):
+            self.stats.inc_value("frontier/pushed", spider=self.spider)
+            return True
+        if request.dont_filter or request.meta.get("replay") or request.meta.get("incremental"):
+            # Повтор из dead-letter или перезапрос изменившейся статьи: запись может быть уже
+            # завершена или брошена, тогда запрос снова ставится в очередь
+            if self.frontier.reset(fingerprint, data, request.priority):
+                self.stats.inc_value("frontier/reset", spider=self.spider)
+                return True
+            self.stats.inc_value("frontier/reset_skipped", spider=self.spider)
+            self.spider.logger.debug(f"Фронтир: запрос уже в очереди или в аренде, не сбрасываем: {request.url}")
+        self.df.log(request, self.spider)
+        self.stats.inc_value("frontier/duplicates", spider=self.spider)
+        return False
+
+    def next_request(self):
+        # Сначала продолжения уже разобранных статей (IMDb, API), затем новые запросы фронтира
+        request = super().next_request()
+        if request is not None:
+            return request
+
+        claimed, expired, failed = self.frontier.claim(self.node)
+        if expired:
+            self.stats.inc_value("frontier/expired_leases", expired, spider=self.spider)
+        if failed:
+            self.stats.inc_value("frontier/failed", failed, spider=self.spider)
+            self.spider.logger.warning(f"Фронтир: {failed} запросов брошены после {self.frontier.max_claims} аренд")
+        if claimed is None:
+            return None
+
+        fingerprint, data, claims = claimed
+        request = request_from_dict(pickle.loads(data), spider=self.spider)
+        request.meta["frontier_lease"] = (fingerprint, claims)
+        self.stats.inc_value("frontier/claimed", spider=self.spider)
+        return request
+
+
+class FrontierAckMiddleware:
+    """Завершает аренду запроса фронтира, когда он обработан."""
+
+    def __init__(self, frontier, node, stats=None):
+        self.frontier = frontier
+        self.node = node
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not shared_scheduler_enabled(crawler.settings):
+            raise NotConfigured
+        middleware = cls(open_frontier(crawler.settings), node_name(crawler.settings), crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def ack(self, request):
+        lease = request.meta.get("frontier_lease") if request is not None else None
+        if lease and self.frontier.ack(lease[0], self.node, lease[1]) and self.stats is not None:
+            self.stats.inc_value("frontier/acked")
+
+    def spider_closed(self, spider):
+        self.frontier.close()
+
+
+class FrontierSpiderMiddleware(FrontierAckMiddleware):
+    def process_spider_output(self, response, result, spider):
+        # Аренда снимается после того, как все запросы из колбэка попали во фронтир
+        yield from result
+        self.ack(response.request)
+
+    def process_spider_exception(self, response, exception, spider):
+        self.ack(response.request)
+
+
+class FrontierDownloaderMiddleware(FrontierAckMiddleware):
+    def process_exception(self, request, exception, spider):
+        # Колбэк не будет вызван; повтор из errback вернёт запрос в очередь
+        self.ack(request)
@@ -0,0 +1,172 @@
+# HTTP cache for Wikipedia pages in a single SQLite file
+#
+# SqliteCacheStorage keeps zlib-compressed responses keyed by request
+# fingerprint, together with the MediaWiki revision id of the page.
+# WikipediaCachePolicy caches only real Wikipedia pages and MediaWiki /
+# Wikidata API responses that carry revision ids (or a continue payload),
+# revalidates them with If-Modified-Since / If-None-Match (RFC2616Policy) or
+# with a known revid, and treats everything cached as fresh in offline mode
+# (HTTPCACHE_IGNORE_MISSING), so the API engine can re-run from the cache too.
+import json
+import re
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+
+CACHED_HOSTS = ("ru.wikipedia.org", "www.wikidata.org")
+
+REVID_PATTERN = re.compile(rb'"wgRevisionId":(\d+)')
+
+# Сколько ответов сохранить, прежде чем зафиксировать транзакцию
+COMMIT_EVERY = 100
+
+
+def page_revid(body):
+    """Номер ревизии MediaWiki из конфигурации страницы (wgRevisionId), если он есть."""
+    match = REVID_PATTERN.search(body)
+    return int(match.group(1)) if match else None
+
+
+def api_payload(body):
+    """Разобранный JSON-ответ API или None, если тело - не JSON-объект."""
+    if body.lstrip()[:1] != b"{":
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def api_revids(data):
+    """Номера ревизий в ответе API: lastrevid и revisions[].revid страниц, lastrevid элементов Wikidata."""
+    pages = data.get("query", {}).get("pages", [])
+    if isinstance(pages, dict):  # formatversion=1
+        pages = pages.values()
+    revids = []
+    for page in [*pages, *data.get("entities", {}).values()]:
+        if "lastrevid" in page:
+            revids.append(page["lastrevid"])
+        revids.extend(revision["revid"] for revision in page.get("revisions", []) if "revid" in revision)
+    return revids
+
+
+def response_revid(body):
+    """Ревизия ответа: wgRevisionId страницы или последняя из ревизий в ответе API (пакет страниц)."""
+    revid = page_revid(body)
+    if revid is None:
+        data = api_payload(body)
+        revids = api_revids(data) if data else []
+        revid = max(revids) if revids else None
+    return revid
+
+
+class SqliteCacheStorage:
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.compression_level = settings.getint("HTTPCACHE_SQLITE_COMPRESSION_LEVEL", 6)
+        self.db = None
+        self.pending_writes = 0
+
+    def open_spider(self, spider):
+        path = Path(self.cachedir, f"{spider.name}.sqlite")
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint BLOB PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                revid INTEGER,
+                stored_at REAL NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        spider.logger.debug(f"Using SQLite cache storage in {path}")
+
+    def close_spider(self, spider):
+        self.db.commit()
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute(
+            "SELECT url, status, headers, body, stored_at FROM responses WHERE fingerprint = ?",
+            (self._fingerprinter.fingerprint(request),),
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, stored_at = row
+        if 0 < self.expiration_secs < time.time() - stored_at:
+            return None
+
+        headers = Headers({name: [value.encode("latin-1") for value in values]
+                           for name, values in json.loads(headers).items()})
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        headers = {name.decode("latin-1"): [value.decode("latin-1") for value in values]
+                   for name, values in response.headers.items()}
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                self._fingerprinter.fingerprint(request),
+                response.url,
+                response.status,
+                json.dumps(headers),
+                zlib.compress(response.body, self.compression_level),
+                response_revid(response.body),
+                time.time(),
+            ),
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending_writes = 0
+
+
+class WikipediaCachePolicy(RFC2616Policy):
+    """RFC 2616 для страниц Википедии; IMDb и прочие хосты идут мимо кэша.
+
+    Если в meta запроса передан актуальный revid страницы и он совпадает с
+    сохранённым, страница отдаётся из кэша без обращения к сети.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        # Офлайн-режим: всё берём из кэша, отсутствующее в кэше пропускается
+        self.offline = settings.getbool("HTTPCACHE_IGNORE_MISSING")
+
+    def should_cache_request(self, request):
+        if not self.offline and urlparse_cached(request).hostname not in CACHED_HOSTS:
+            return False
+        return super().should_cache_request(request)
+
+    def should_cache_response(self, response, request):
+        # Только настоящие страницы Википедии и ответы API: ошибки и мусор от прокси в кэш не попадают
+        if response.status != 200:
+            return False
+        if page_revid(response.body) is None:
+            data = api_payload(response.body)
+            if data is None or not (api_revids(data) or "continue" in data):
+                return False
+        return super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self.offline:
+            return True
+        revid = request.meta.get("revid")
+        if revid is not None and response_revid(cachedresponse.body) == revid:
+            return True
+        return super().is_cached_response_fresh(cachedresponse, request)
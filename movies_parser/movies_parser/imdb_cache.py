@@ -0,0 +1,131 @@
+# Persistent cache for IMDb lookups
+#
+# Maps (normalized title, year) to the IMDb tt-ID and the tt-ID to its rating,
+# so recrawls skip the search step and only refresh stale ratings.
+import re
+import sqlite3
+import time
+
+# Сколько записей изменить, прежде чем зафиксировать транзакцию
+COMMIT_EVERY = 100
+
+
+def normalize_title(title):
+    """Приводит название к виду ключа кэша: без года в скобках, регистра и лишних пробелов."""
+    if not title:
+        return ""
+    title = re.sub(r"\s*\(\d{4}\)\s*$", "", title)
+    title = re.sub(r"\s+", " ", title)
+    return title.strip().casefold()
+
+
+def imdb_id_from_link(imdb_link):
+    """Извлекает tt-ID из ссылки на IMDb."""
+    match = re.search(r"tt\d+", imdb_link or "")
+    return match.group(0) if match else None
+
+
+class ImdbCache:
+    def __init__(self, path, rating_ttl, id_ttl, max_entries, stats=None):
+        self.rating_ttl = rating_ttl
+        self.id_ttl = id_ttl
+        self.max_entries = max_entries
+        self.stats = stats
+        self.pending_writes = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS titles (
+                title TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                imdb_id TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (title, year)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS ratings (
+                imdb_id TEXT PRIMARY KEY,
+                rating TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS titles_accessed ON titles (accessed_at);
+            CREATE INDEX IF NOT EXISTS ratings_accessed ON ratings (accessed_at);
+        """)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            path=settings.get("IMDB_CACHE_PATH", "imdb_cache.sqlite"),
+            rating_ttl=settings.getfloat("IMDB_CACHE_RATING_TTL", 7 * 24 * 3600),
+            id_ttl=settings.getfloat("IMDB_CACHE_ID_TTL", 180 * 24 * 3600),
+            max_entries=settings.getint("IMDB_CACHE_MAX_ENTRIES", 500_000),
+            stats=crawler.stats,
+        )
+
+    def get_imdb_id(self, title, year):
+        """Возвращает tt-ID для названия и года, если он известен и не устарел."""
+        key = (normalize_title(title), int(year or 0))
+        row = self.db.execute(
+            "SELECT imdb_id, fetched_at FROM titles WHERE title = ? AND year = ?", key,
+        ).fetchone()
+        if not row or time.time() - row[1] > self.id_ttl:
+            self._inc("imdb_cache/id/stale" if row else "imdb_cache/id/miss")
+            return None
+
+        self._inc("imdb_cache/id/hit")
+        self._write("UPDATE titles SET accessed_at = ? WHERE title = ? AND year = ?", (time.time(), *key))
+        return row[0]
+
+    def set_imdb_id(self, title, year, imdb_id):
+        now = time.time()
+        self._write(
+            "INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?)",
+            (normalize_title(title), int(year or 0), imdb_id, now, now),
+        )
+
+    def get_rating(self, imdb_id):
+        """Возвращает пару (найдено, рейтинг); рейтинг может быть None, если у фильма его нет."""
+        row = self.db.execute("SELECT rating, fetched_at FROM ratings WHERE imdb_id = ?", (imdb_id,)).fetchone()
+        if not row or time.time() - row[1] > self.rating_ttl:
+            self._inc("imdb_cache/rating/stale" if row else "imdb_cache/rating/miss")
+            return False, None
+
+        self._inc("imdb_cache/rating/hit")
+        self._write("UPDATE ratings SET accessed_at = ? WHERE imdb_id = ?", (time.time(), imdb_id))
+        return True, row[0]
+
+    def set_rating(self, imdb_id, rating):
+        now = time.time()
+        self._write("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?)", (imdb_id, rating, now, now))
+
+    def evict(self):
+        """Удаляет давно не использованные записи сверх лимита (LRU)."""
+        for table, key in (("titles", "(title, year)"), ("ratings", "imdb_id")):
+            count = self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]  # noqa: S608
+            excess = count - self.max_entries
+            if excess > 0:
+                self.db.execute(
+                    f"DELETE FROM {table} WHERE {key} IN ("  # noqa: S608
+                    f"SELECT {key} FROM {table} ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+                self._inc("imdb_cache/evicted", excess)
+        self.db.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+    def _write(self, query, params):
+        self.db.execute(query, params)
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending_writes = 0
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
@@ -0,0 +1,80 @@
+# Local IMDb datasets (https://datasets.imdbws.com/)
+#
+# title.ratings.tsv.gz (tconst, averageRating, numVotes; ~1.5M rows, updated
+# daily) is converted once into a sorted array of 64-bit keys saved next to it
+# as .npy: the tt number in the high 32 bits, the rating x10 in the next 8 and
+# the vote count (capped) in the low 24. The array is memory-mapped, so a
+# lookup is a binary search over pages the OS loads on demand, and movies
+# with a known tt-ID get their rating without any HTTP request.
+import gzip
+import re
+from pathlib import Path
+
+import numpy as np
+
+VOTES_MAX = (1 << 24) - 1
+
+TCONST_PATTERN = re.compile(r"tt(\d+)")
+
+
+def tconst_number(imdb_id):
+    """Числовая часть tt-ID ("tt0111161" -> 111161) или None, если это не tt-ID или он не помещается в 32 бита."""
+    match = TCONST_PATTERN.fullmatch(imdb_id or "")
+    if not match or len(match.group(1)) > 9:
+        return None
+    return int(match.group(1))
+
+
+def build_ratings_index(dataset_path, index_path):
+    """Строит отсортированный массив ключей из title.ratings.tsv.gz (потоково, построчно)."""
+    keys = []
+    with gzip.open(dataset_path, "rt", encoding="utf-8") as f:
+        next(f)  # Заголовок: tconst, averageRating, numVotes
+        for line in f:
+            tconst, rating, votes = line.rstrip("\n").split("\t")
+            number = tconst_number(tconst)
+            if number is None or rating == r"\N":
+                continue
+            keys.append(number << 32 | round(float(rating) * 10) << 24 | min(int(votes), VOTES_MAX))
+    index = np.array(keys, dtype=np.uint64)
+    index.sort()
+
+    index_path = Path(index_path)
+    tmp_path = index_path.with_name(f".{index_path.name}.tmp.npy")
+    np.save(tmp_path, index)
+    tmp_path.replace(index_path)
+    return len(index)
+
+
+class ImdbRatings:
+    """Рейтинги IMDb из локального title.ratings.tsv.gz."""
+
+    def __init__(self, dataset_path, index_path=None):
+        dataset_path = Path(dataset_path)
+        self.index_path = Path(index_path) if index_path else dataset_path.with_name(
+            dataset_path.name.split(".tsv")[0] + ".npy"
+        )
+        # Индекс перестраивается, когда скачан более свежий файл
+        if not self.index_path.exists() or self.index_path.stat().st_mtime < dataset_path.stat().st_mtime:
+            build_ratings_index(dataset_path, self.index_path)
+        self.index = np.load(self.index_path, mmap_mode="r")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings["IMDB_RATINGS_DATASET"], crawler.settings.get("IMDB_RATINGS_INDEX"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, imdb_id):
+        """(рейтинг строкой, как на странице IMDb, число голосов) или None, если фильма нет в датасете."""
+        number = tconst_number(imdb_id)
+        if number is None:
+            return None
+        position = int(np.searchsorted(self.index, np.uint64(number << 32)))
+        if position == len(self.index):
+            return None
+        key = int(self.index[position])
+        if key >> 32 != number:
+            return None
+        return f"{(key >> 24 & 0xFF) / 10:.1f}", key & VOTES_MAX
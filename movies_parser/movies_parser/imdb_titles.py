@@ -0,0 +1,271 @@
+# Local IMDb title matching (https://datasets.imdbws.com/)
+#
+# title.basics.tsv.gz (primary and original titles, type, year) and the
+# regional titles from title.akas.tsv.gz are indexed once into a read-only
+# SQLite file: normalized title keys with the films they name, plus an FTS5
+# trigram index over the keys. Films without an IMDb link in the infobox are
+# matched by their original and Russian titles and year. An exact key is looked
+# up first, a fuzzy one only for titles missing from the index. Fuzzy candidates
+# are the keys sharing most of the rarest trigrams of the title (key counts are
+# kept per trigram, and only as many posting lists are read as fit in
+# FUZZY_MAX_POSTINGS). Candidates are scored by trigram similarity and year, a
+# film matched by both titles scores higher, and a film that is too close to
+# its runner-up is not trusted. The file is memory-mapped, so several crawls
+# share one copy in the page cache.
+import gzip
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+from movies_parser.imdb_datasets import tconst_number
+
+# Фильмы категории: полнометражные, телефильмы, видео и короткометражные
+TITLE_TYPES = ("movie", "tvMovie", "video", "short")
+# Русские названия (SUHH - прокат в СССР)
+AKAS_REGIONS = ("RU", "SUHH")
+# Уточнения в скобках в конце названия: "Брат 2 (фильм)", "Солярис (1972)"
+TRAILING_PARENTHESES_PATTERN = re.compile(r"(\s*\([^()]*\))+\s*$")
+WORD_PATTERN = re.compile(r"\w+")
+# Сколько похожих ключей берётся из триграммного индекса; сколько всего ключей можно
+# перебрать в списках самых редких триграмм названия
+FUZZY_CANDIDATES = 50
+FUZZY_MAX_POSTINGS = 20_000
+# Разница с ближайшим другим фильмом, при которой совпадение считается однозначным
+AMBIGUITY_MARGIN = 0.2
+# Вес совпадения второго названия с тем же фильмом
+SECOND_TITLE_WEIGHT = 0.25
+BATCH_SIZE = 50_000
+
+
+def match_key(title):
+    """Ключ для сравнения названий: без уточнений в скобках, регистра, диакритики и знаков препинания."""
+    if not title:
+        return ""
+    title = TRAILING_PARENTHESES_PATTERN.sub("", title)
+    title = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(ch for ch in title if not unicodedata.combining(ch))
+    return " ".join(WORD_PATTERN.findall(title))
+
+
+def trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+def similarity(grams, other_grams):
+    """Коэффициент Дайса по множествам триграмм."""
+    if not grams or not other_grams:
+        return 0.0
+    return 2 * len(grams & other_grams) / (len(grams) + len(other_grams))
+
+
+def year_factor(year, candidate_year):
+    """Насколько год подтверждает совпадение: фестивальный показ и прокат часто в разные годы."""
+    if not year or not candidate_year:
+        return 0.6
+    difference = abs(year - candidate_year)
+    return 1.0 if difference == 0 else 0.9 if difference == 1 else 0.0
+
+
+def read_tsv(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = next(f).rstrip("\n").split("\t")
+        for line in f:
+            yield dict(zip(header, line.rstrip("\n").split("\t")))
+
+
+def build_titles_index(basics_path, akas_path, index_path, title_types, regions):
+    """Строит индекс названий из title.basics (и title.akas, если задан) потоково, пакетами."""
+    index_path = Path(index_path)
+    tmp_path = index_path.with_name(f".{index_path.name}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    db = sqlite3.connect(tmp_path)
+    db.executescript("""
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE titles (tconst INTEGER PRIMARY KEY, year INTEGER NOT NULL);
+        CREATE TABLE keys (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE);
+        -- Год в ключе: фильмы с частым названием ("Любовь") выбираются диапазоном по году
+        CREATE TABLE names (
+            key_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            tconst INTEGER NOT NULL,
+            PRIMARY KEY (key_id, year, tconst)
+        ) WITHOUT ROWID;
+        CREATE VIRTUAL TABLE keys_fts USING fts5(key, content='', tokenize='trigram', detail='none');
+        CREATE TEMP TABLE staging (key TEXT NOT NULL, tconst INTEGER NOT NULL);
+    """)
+    title_types = set(title_types)
+    regions = set(regions)
+
+    titles, names = [], []
+
+    def flush():
+        db.executemany("INSERT OR IGNORE INTO titles VALUES (?, ?)", titles)
+        db.executemany("INSERT INTO staging VALUES (?, ?)", names)
+        titles.clear()
+        names.clear()
+
+    for row in read_tsv(basics_path):
+        number = tconst_number(row["tconst"])
+        if number is None or row["titleType"] not in title_types:
+            continue
+        # Год неизвестен - 0
+        titles.append((number, int(row["startYear"]) if row["startYear"].isdigit() else 0))
+        for title in {row["primaryTitle"], row["originalTitle"]}:
+            names.append((match_key(title), number))
+        if len(names) >= BATCH_SIZE:
+            flush()
+    # Региональные названия: русские и оригинальные; фильмы других типов отсеются при объединении
+    for row in read_tsv(akas_path) if akas_path else ():
+        if row["region"] not in regions and row["isOriginalTitle"] != "1":
+            continue
+        number = tconst_number(row["titleId"])
+        if number is not None:
+            names.append((match_key(row["title"]), number))
+        if len(names) >= BATCH_SIZE:
+            flush()
+    flush()
+
+    db.executescript("""
+        DELETE FROM staging WHERE key = '' OR tconst NOT IN (SELECT tconst FROM titles);
+        INSERT INTO keys (key) SELECT DISTINCT key FROM staging;
+        INSERT OR IGNORE INTO names SELECT keys.id, titles.year, tconst FROM staging JOIN keys USING (key) JOIN titles USING (tconst);
+        INSERT INTO keys_fts (rowid, key) SELECT id, key FROM keys;
+        DROP TABLE staging;
+        CREATE VIRTUAL TABLE temp.vocabulary USING fts5vocab(main, keys_fts, 'row');
+        CREATE TABLE trigrams (trigram TEXT PRIMARY KEY, keys INTEGER NOT NULL) WITHOUT ROWID;
+        INSERT INTO trigrams SELECT term, doc FROM temp.vocabulary;
+    """)
+    db.commit()
+    count = db.execute("SELECT count(*) FROM titles").fetchone()[0]
+    db.execute("VACUUM")
+    db.close()
+    tmp_path.replace(index_path)
+    return count
+
+
+class ImdbTitles:
+    """Сопоставление фильмов с tt-ID по локальным датасетам IMDb."""
+
+    def __init__(self, basics_path, akas_path=None, index_path=None, title_types=TITLE_TYPES, regions=AKAS_REGIONS,
+                 ratings=None, mmap_size=1 << 30):
+        basics_path = Path(basics_path)
+        self.index_path = Path(index_path) if index_path else basics_path.with_name("imdb_titles.sqlite")
+        sources = [Path(path) for path in (basics_path, akas_path) if path]
+        # Индекс перестраивается, когда скачаны более свежие файлы
+        if not self.index_path.exists() or any(
+            self.index_path.stat().st_mtime < source.stat().st_mtime for source in sources
+        ):
+            build_titles_index(basics_path, akas_path, self.index_path, title_types, regions)
+        self.db = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        # Число голосов из датасета рейтингов: при равной оценке выбирается более известный фильм
+        self.ratings = ratings
+
+    @classmethod
+    def from_crawler(cls, crawler, ratings=None):
+        settings = crawler.settings
+        return cls(
+            settings["IMDB_TITLES_BASICS"],
+            akas_path=settings.get("IMDB_TITLES_AKAS"),
+            index_path=settings.get("IMDB_TITLES_INDEX"),
+            title_types=settings.getlist("IMDB_TITLES_TYPES", TITLE_TYPES),
+            regions=settings.getlist("IMDB_TITLES_AKAS_REGIONS", AKAS_REGIONS),
+            ratings=ratings,
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM titles").fetchone()[0]
+
+    def candidates(self, condition, parameters, year):
+        """(tt-номер, год, ключ) фильмов с подходящими ключами; при известном годе - только соседних лет."""
+        query = (
+            "SELECT names.tconst, names.year, keys.key FROM keys JOIN names ON names.key_id = keys.id "
+            f"WHERE {condition}"
+        )
+        if year:
+            return self.db.execute(f"{query} AND names.year BETWEEN ? AND ?", (*parameters, year - 1, year + 1)).fetchall()
+        return self.db.execute(f"{query} LIMIT ?", (*parameters, FUZZY_CANDIDATES)).fetchall()
+
+    def exact(self, key, year):
+        return self.candidates("keys.key = ?", (key,), year)
+
+    def fuzzy(self, grams, year):
+        # Списки ключей читаются для самых редких триграмм, пока не исчерпан бюджет: частые
+        # ("the", " of") встречаются в сотнях тысяч ключей. Кандидаты - ключи с наибольшим
+        # числом общих триграмм (опечатка меняет лишь несколько из них)
+        shared = Counter()
+        budget = FUZZY_MAX_POSTINGS
+        rare = self.db.execute(
+            f"SELECT trigram, keys FROM trigrams WHERE trigram IN ({', '.join('?' * len(grams))}) ORDER BY keys",
+            tuple(grams),
+        ).fetchall()
+        for gram, keys in rare:
+            if keys > budget:
+                break
+            budget -= keys
+            shared.update(key_id for key_id, in self.db.execute(
+                "SELECT rowid FROM keys_fts WHERE keys_fts MATCH ?", (f'"{gram}"',)
+            ))
+        if not shared:
+            return []
+        key_ids = [key_id for key_id, _ in shared.most_common(FUZZY_CANDIDATES)]
+        return self.candidates(f"keys.id IN ({', '.join('?' * len(key_ids))})", key_ids, year)
+
+    def votes(self, tconst):
+        found = self.ratings.get(f"tt{tconst:07d}") if self.ratings is not None else None
+        return found[1] if found else 0
+
+    def best(self, similarities, years, year):
+        """(tt-номер, уверенность) лучшего кандидата или None."""
+        # Совпадение второго названия (русского и оригинального) с тем же фильмом добавляет уверенности
+        scores = {
+            tconst: year_factor(year, years[tconst]) * (
+                max(found.values()) + SECOND_TITLE_WEIGHT * (sum(found.values()) - max(found.values()))
+            )
+            for tconst, found in similarities.items()
+        }
+        ranked = sorted(scores.items(), key=lambda item: (item[1], self.votes(item[0])), reverse=True)
+        if not ranked or ranked[0][1] == 0:
+            return None
+        (tconst, best), runner_up = ranked[0], ranked[1][1] if len(ranked) > 1 else 0.0
+        return tconst, min(best, 1.0) * min(1.0, (best - runner_up) / AMBIGUITY_MARGIN)
+
+    def match(self, titles, year=None, min_confidence=0.8):
+        """(tt-ID, уверенность от 0 до 1) лучшего фильма по названиям и году или None, если кандидатов нет."""
+        # Сходство каждого кандидата с каждым из названий
+        similarities = {}
+        years = {}
+
+        def add(key, candidates, grams=None):
+            for tconst, candidate_year, candidate_key in candidates:
+                found = similarities.setdefault(tconst, {})
+                found[key] = max(found.get(key, 0.0), similarity(grams, trigrams(candidate_key)) if grams else 1.0)
+                years[tconst] = candidate_year
+
+        missing = []
+        for key in dict.fromkeys(key for key in map(match_key, titles) if key):
+            exact = self.exact(key, year)
+            add(key, exact)
+            if not exact:
+                missing.append(key)
+
+        best = self.best(similarities, years, year)
+        # Неточный поиск - для названий, которых нет в индексе, если точные не дали уверенного
+        # совпадения и если с таким годом оно вообще возможно
+        if missing and (best is None or best[1] < min_confidence) and year_factor(year, year) >= min_confidence:
+            for key in missing:
+                grams = trigrams(key)
+                if grams:
+                    add(key, self.fuzzy(grams, year), grams)
+            best = self.best(similarities, years, year)
+
+        if best is None:
+            return None
+        tconst, confidence = best
+        return f"tt{tconst:07d}", round(confidence, 3)
+
+    def close(self):
+        self.db.close()
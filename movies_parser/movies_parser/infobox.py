@@ -0,0 +1,147 @@
+# Single-pass index of a Wikipedia infobox
+#
+# The table is walked once: every <th> label is mapped to its <td> cell and
+# the helpers in spiders/movies.py look labels up in that index instead of
+# searching the DOM again for each field. The index can be built either from
+# Scrapy's Selector (lxml tree of the response, the fast path) or from a
+# BeautifulSoup tag; both produce the same InfoboxCell values.
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+
+class InfoboxCell(NamedTuple):
+    """Содержимое ячейки <td> инфобокса."""
+
+    text: str
+    # Пары (текст, href) для всех ссылок <a> в ячейке
+    links: list
+    # Непустые <span>, строки внутри каждого объединены через ", "
+    spans: list
+
+
+@lru_cache(maxsize=None)
+def label_pattern(label):
+    """Компилирует шаблон метки один раз на процесс."""
+    return re.compile(label)
+
+
+def soup_tags(tag, name):
+    """Потомки тега с заданным именем; быстрее find_all, т.к. не строит фильтр."""
+    return [child for child in tag.descendants if child.name == name]
+
+
+def soup_cell(td):
+    """Собирает InfoboxCell из тега BeautifulSoup."""
+    links = []
+    spans = []
+    for child in td.descendants:
+        if child.name == "a":
+            links.append((child.text, child.get("href")))
+        elif child.name == "span" and child.text.strip():
+            spans.append(", ".join(child.stripped_strings))
+    return InfoboxCell(text=td.text, links=links, spans=spans)
+
+
+def soup_subtitle(row):
+    """Возвращает текст последнего <span> второй строки, если это не заголовок и не изображение."""
+    cell = next((td for td in soup_tags(row, "td") if td.get("colspan") == "2"), None)
+    if not cell or soup_tags(row, "th") or soup_tags(cell, "img"):
+        return None
+    spans = soup_tags(cell, "span")
+    return spans[-1].get_text(strip=True) if spans else None
+
+
+def soup_next_td(th):
+    """Аналог find_next_sibling("td")."""
+    return next((sibling for sibling in th.next_siblings if sibling.name == "td"), None)
+
+
+def lxml_text(element):
+    """Аналог Tag.text для элемента lxml (комментарии не учитываются)."""
+    return "".join(element.itertext())
+
+
+def lxml_string(element):
+    """Аналог Tag.string: текст, если у элемента ровно один потомок-строка (возможно, вложенный)."""
+    children = list(element)
+    if not children:
+        return element.text or None
+    if element.text or len(children) > 1 or children[0].tail or not isinstance(children[0].tag, str):
+        return None
+    return lxml_string(children[0])
+
+
+def lxml_cell(td):
+    """Собирает InfoboxCell из элемента lxml."""
+    links = []
+    spans = []
+    for child in td.iterdescendants("a", "span"):
+        if child.tag == "a":
+            links.append((lxml_text(child), child.get("href")))
+        else:
+            strings = [text.strip() for text in child.itertext() if text.strip()]
+            if strings:
+                spans.append(", ".join(strings))
+    return InfoboxCell(text=lxml_text(td), links=links, spans=spans)
+
+
+def lxml_subtitle(row):
+    """Аналог soup_subtitle для элемента lxml."""
+    cell = next((td for td in row.iterdescendants("td") if td.get("colspan") == "2"), None)
+    if cell is None or next(row.iterdescendants("th"), None) is not None:
+        return None
+    if next(cell.iterdescendants("img"), None) is not None:
+        return None
+    spans = list(cell.iterdescendants("span"))
+    return "".join(text.strip() for text in spans[-1].itertext()) if spans else None
+
+
+class Infobox:
+    def __init__(self, rows, subtitle=None, make_cell=soup_cell):
+        # Пары (метка <th>, узел <td> или None) в порядке документа
+        self.rows = rows
+        # Кандидат в оригинальное название из второй строки таблицы
+        self.subtitle = subtitle
+        self.make_cell = make_cell
+        self.cells = {}
+
+    @classmethod
+    def from_soup(cls, table):
+        """Строит индекс за один обход таблицы BeautifulSoup."""
+        rows = []
+        tr_count = 0
+        subtitle = None
+        for tag in table.descendants:
+            if tag.name == "tr":
+                tr_count += 1
+                if tr_count == 2:
+                    subtitle = soup_subtitle(tag)
+            elif tag.name == "th":
+                # Как и find("th", string=...), учитываем только метки из одной строки
+                rows.append((tag.string, soup_next_td(tag)))
+        return cls(rows, subtitle, soup_cell)
+
+    @classmethod
+    def from_selector(cls, table):
+        """Строит индекс за один обход таблицы из Selector (или элемента lxml)."""
+        table = getattr(table, "root", table)
+        rows = []
+        tr_count = 0
+        subtitle = None
+        for tag in table.iterdescendants("tr", "th"):
+            if tag.tag == "tr":
+                tr_count += 1
+                if tr_count == 2:
+                    subtitle = lxml_subtitle(tag)
+            else:
+                rows.append((lxml_string(tag), next(tag.itersiblings("td"), None)))
+        return cls(rows, subtitle, lxml_cell)
+
+    def cell(self, label):
+        """Возвращает ячейку первой строки, метка которой совпадает с шаблоном label."""
+        if label not in self.cells:
+            pattern = label_pattern(label)
+            td = next((td for text, td in self.rows if text is not None and pattern.search(text)), None)
+            self.cells[label] = self.make_cell(td) if td is not None else None
+        return self.cells[label]
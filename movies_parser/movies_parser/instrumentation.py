@@ -0,0 +1,98 @@
+# Per-stage latency histograms kept in Scrapy stats
+#
+# Every stage (category parse, movie parse, IMDb search, IMDb title, pipeline
+# write, and the download time of each request type) gets a count, an error
+# count, a total and a max, plus a fixed-bucket histogram. Recording costs a
+# handful of dict updates, cheap enough to leave on in production.
+import json
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+# Верхние границы корзин гистограммы, мс
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class StageStats:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def record(self, stage, seconds, error=False):
+        """Учитывает одно выполнение этапа."""
+        ms = seconds * 1000
+        prefix = f"timing/{stage}"
+        index = bisect_left(BUCKETS_MS, ms)
+        bucket = BUCKETS_MS[index] if index < len(BUCKETS_MS) else "inf"
+        self.stats.inc_value(f"{prefix}/count")
+        self.stats.inc_value(f"{prefix}/total_ms", ms)
+        self.stats.max_value(f"{prefix}/max_ms", ms)
+        self.stats.inc_value(f"{prefix}/le_{bucket}")
+        if error:
+            self.stats.inc_value(f"{prefix}/errors")
+
+    def snapshot(self):
+        """Сводка по этапам: количество, доля ошибок, среднее, оценки p50/p99 и корзины."""
+        result = {}
+        stages = sorted(
+            key[len("timing/"):-len("/count")] for key in self.stats.get_stats()
+            if key.startswith("timing/") and key.endswith("/count")
+        )
+        for stage in stages:
+            prefix = f"timing/{stage}"
+            count = self.stats.get_value(f"{prefix}/count", 0)
+            buckets = {
+                str(bound): self.stats.get_value(f"{prefix}/le_{bound}", 0)
+                for bound in (*BUCKETS_MS, "inf")
+            }
+            errors = self.stats.get_value(f"{prefix}/errors", 0)
+            result[stage] = {
+                "count": count,
+                "errors": errors,
+                "error_rate": round(errors / count, 4),
+                "mean_ms": round(self.stats.get_value(f"{prefix}/total_ms", 0) / count, 3),
+                "max_ms": round(self.stats.get_value(f"{prefix}/max_ms", 0), 3),
+                "p50_ms": bucket_quantile(buckets, count, 0.5),
+                "p99_ms": bucket_quantile(buckets, count, 0.99),
+                "buckets": buckets,
+            }
+        return result
+
+    def dump_jsonl(self, path):
+        """Дописывает текущую сводку строкой JSON."""
+        line = json.dumps({"time": time.time(), "stages": self.snapshot()}, ensure_ascii=False)
+        with Path(path).open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def dump_prometheus(self, path):
+        """Записывает гистограммы в формате textfile collector (атомарно через переименование)."""
+        lines = [
+            "# HELP movies_stage_seconds Time spent in each crawl stage.",
+            "# TYPE movies_stage_seconds histogram",
+        ]
+        errors = ["# TYPE movies_stage_errors_total counter"]
+        for stage, summary in self.snapshot().items():
+            cumulative = 0
+            for bound, count in summary["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else str(int(bound) / 1000)
+                lines.append(f'movies_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            total_seconds = self.stats.get_value(f"timing/{stage}/total_ms", 0) / 1000
+            lines.append(f'movies_stage_seconds_sum{{stage="{stage}"}} {total_seconds:.6f}')
+            lines.append(f'movies_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+            errors.append(f'movies_stage_errors_total{{stage="{stage}"}} {summary["errors"]}')
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        Path(tmp_path).write_text("\n".join(lines + errors) + "\n", encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+def bucket_quantile(buckets, count, q):
+    """Оценка квантиля по гистограмме: верхняя граница корзины, в которую он попадает."""
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in buckets.items():
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return None if bound == "inf" else int(bound)
+    return None
@@ -2,16 +2,88 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+#
+# Items are slotted dataclasses (supported by Scrapy through itemadapter):
+# values are normalized and validated once, when the item is created, and
+# the writers serialize the typed fields in the form each output format needs.
+import re
+from dataclasses import dataclass
+
+IMDB_ID_PATTERN = re.compile(r"tt\d+")
+
+
+def normalize_list(value):
+    """Кортеж значений из строки через запятую или из последовательности, без пустых.
+
+    Ячейка инфобокса может содержать несколько значений через запятую ("драма, комедия").
+    """
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    return tuple(part.strip() for s in value if s for part in s.split(",") if part.strip())
+
+
+def normalize_rating(value):
+    """Рейтинг IMDb числом от 0 до 10 (из строки "7.9" или "7,9"), или None."""
+    if value is None or value == "":
+        return None
+    rating = float(value.replace(",", ".") if isinstance(value, str) else value)
+    if not 0 <= rating <= 10:
+        raise ValueError(f"Рейтинг IMDb вне диапазона 0-10: {value!r}")
+    return rating
+
+
+def normalize_title(value):
+    title = value.strip() if isinstance(value, str) else ""
+    if not title:
+        raise ValueError(f"Пустое название фильма: {value!r}")
+    return title
+
+
+def normalize_imdb_id(value):
+    if not value:
+        return None
+    if not IMDB_ID_PATTERN.fullmatch(value):
+        raise ValueError(f"Некорректный IMDb ID: {value!r}")
+    return value
+
+
+@dataclass(slots=True)
+class MoviesParserItem:
+    title: str
+    original_title: str | None = None
+    genre: tuple[str, ...] = ()
+    director: tuple[str, ...] = ()
+    country: tuple[str, ...] = ()
+    year: int | None = None
+    imdb_rating: float | None = None
+    imdb_id: str | None = None
+    # Для инкрементального обхода, в файл результатов не пишутся
+    revid: int | None = None
+    rating_updated_at: float | None = None
+
+    def __post_init__(self):
+        self.title = normalize_title(self.title)
+        if self.original_title is not None:
+            self.original_title = self.original_title.strip() or None
+        self.genre = normalize_list(self.genre)
+        self.director = normalize_list(self.director)
+        self.country = normalize_list(self.country)
+        self.year = int(self.year) if self.year not in (None, "") else None
+        self.imdb_rating = normalize_rating(self.imdb_rating)
+        self.imdb_id = normalize_imdb_id(self.imdb_id)
+        self.revid = int(self.revid) if self.revid is not None else None
+
 
-import scrapy
+@dataclass(slots=True)
+class RatingUpdate:
+    """Обновление только рейтинга уже сохранённого фильма (инкрементальный обход, повтор из dead-letter)."""
 
+    title: str
+    imdb_rating: float | None
+    rating_updated_at: float
 
-class MoviesParserItem(scrapy.Item):
-    # define the fields for your item here like:
-    title = scrapy.Field()
-    original_title = scrapy.Field()
-    genre = scrapy.Field()
-    director = scrapy.Field()
-    country = scrapy.Field()
-    year = scrapy.Field()
-    imdb_rating = scrapy.Field()
+    def __post_init__(self):
+        self.title = normalize_title(self.title)
+        self.imdb_rating = normalize_rating(self.imdb_rating)
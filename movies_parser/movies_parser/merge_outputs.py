@@ -0,0 +1,27 @@
+"""Merge the outputs of several crawl nodes into one file without duplicate titles.
+
+Each node of a distributed crawl (SCHEDULER = SharedScheduler) writes its own
+OUTPUT_PATH; the formats are detected from the paths (.csv, .jsonl, Parquet
+directory) and may differ between sources and target.
+
+    python -m movies_parser.merge_outputs movies.csv movies.node1.csv movies.node2.csv
+"""
+import argparse
+import sys
+
+from movies_parser.writers import merge_outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", help="новый файл (или каталог Parquet) с объединёнными результатами")
+    parser.add_argument("sources", nargs="+", help="файлы результатов узлов")
+    args = parser.parse_args()
+
+    count = merge_outputs(args.sources, args.target)
+    print(f"Записано фильмов: {count} в {args.target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
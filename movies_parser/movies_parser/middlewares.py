@@ -3,101 +3,228 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import functools
+import time
+from pathlib import Path
+from typing import ClassVar
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter  # noqa: F401
 
+from movies_parser.instrumentation import StageStats
+from movies_parser.proxy_pool import ProxyPool
+from movies_parser.proxy_pool import load_proxy_list
+
+
+class StageTimingSpiderMiddleware:
+    """Замеряет время колбэков паука и загрузки по этапам обхода.
+
+    Этап определяется по имени колбэка (STAGES). Сводка периодически
+    дописывается в STAGE_STATS_FILE (JSON lines) и, если задан
+    STAGE_STATS_PROMETHEUS_FILE, в textfile для Prometheus.
+    """
+
+    STAGES: ClassVar[dict[str, str]] = {
+        "parse": "category_parse",
+        "parse_movie": "movie_parse",
+        "parse_imdb_search": "imdb_search",
+        "parse_imdb_title": "imdb_title",
+    }
 
-class MoviesParserSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    def __init__(self, stats, jsonl_path=None, prometheus_path=None, interval=60):
+        self.stage_stats = StageStats(stats)
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.dump_timer = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(
+            crawler.stats,
+            jsonl_path=crawler.settings.get("STAGE_STATS_FILE"),
+            prometheus_path=crawler.settings.get("STAGE_STATS_PROMETHEUS_FILE"),
+            interval=crawler.settings.getfloat("STAGE_STATS_INTERVAL", 60),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def stage(self, response):
+        callback = response.request.callback if response.request else None
+        name = getattr(callback, "__name__", "parse")
+        return self.STAGES.get(name, name)
+
     def process_spider_input(self, response, spider):
         # Called for each response that goes through the spider
         # middleware and into the spider.
-
-        # Should return None or raise an exception.
+        stage = self.stage(response)
+        latency = response.meta.get("download_latency")
+        if latency is not None:
+            self.stage_stats.record(f"{stage}_download", latency, error=response.status >= 400)
+        if response.request is not None:
+            self.time_callback(response.request, spider)
         return None
 
-    def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+    def time_callback(self, request, spider):
+        """Оборачивает колбэк запроса, чтобы замерить сам вызов.
+
+        Scrapy вызывает колбэк не сразу после process_spider_input, а через
+        callLater, поэтому время от process_spider_input включало бы ожидание
+        в реакторе. Обёртка сразу возвращает запросу исходный колбэк: повторы и
+        сериализованные запросы (фронтир, dead letter) её не видят.
+        """
+        callback = request.callback
+
+        @functools.wraps(callback or spider._parse)
+        def timed_callback(response, **kwargs):
+            request.callback = callback
+            started = time.perf_counter()
+            try:
+                return (callback or spider._parse)(response, **kwargs)
+            finally:
+                response.meta["stage_elapsed"] = time.perf_counter() - started
+
+        timed_callback.original_callback = callback
+        request.callback = timed_callback
+
+    def restore_callback(self, request):
+        """Возвращает исходный колбэк, если обёртка не была вызвана (ошибка до вызова колбэка)."""
+        if request is not None and hasattr(request.callback, "original_callback"):
+            request.callback = request.callback.original_callback
 
-        # Must return an iterable of Request, or item objects.
-        for i in result:
+    def process_spider_output(self, response, result, spider):
+        # Колбэки - генераторы, поэтому основное время тратится при итерации:
+        # к вызову колбэка добавляем только время внутри next(), без обработки в других middleware
+        self.restore_callback(response.request)
+        elapsed = response.meta.pop("stage_elapsed", 0.0)
+        iterator = iter(result)
+        while True:
+            started = time.perf_counter()
+            try:
+                i = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
             yield i
+        self.stage_stats.record(self.stage(response), elapsed)
 
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
         # (from other spider middleware) raises an exception.
-
-        # Should return either None or an iterable of Request or item objects.
-        pass
+        self.restore_callback(response.request)
+        elapsed = response.meta.pop("stage_elapsed", 0.0)
+        self.stage_stats.record(self.stage(response), elapsed, error=True)
 
     def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
-
         # Must return only requests (not items).
         for r in start_requests:
             yield r
 
+    def dump(self):
+        if self.jsonl_path:
+            self.stage_stats.dump_jsonl(self.jsonl_path)
+        if self.prometheus_path:
+            self.stage_stats.dump_prometheus(self.prometheus_path)
+
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        if (self.jsonl_path or self.prometheus_path) and self.interval > 0:
+            self.dump_timer = task.LoopingCall(self.dump)
+            self.dump_timer.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.dump_timer and self.dump_timer.running:
+            self.dump_timer.stop()
+        self.dump()
+
 
+class ProxyPoolMiddleware:
+    """Назначает запросам прокси из PROXY_LIST по оценке здоровья (см. proxy_pool.py).
 
-class MoviesParserDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    Запросы, которым прокси задан явно (meta["proxy"]), не трогаются.
+    Повторы от RetryMiddleware получают новый прокси.
+    """
+
+    def __init__(self, pool, stats, failure_codes, state_path=None):
+        self.pool = pool
+        self.stats = stats
+        self.failure_codes = failure_codes
+        self.state_path = state_path
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        proxy_list = settings.get("PROXY_LIST")
+        if not proxy_list or not Path(proxy_list).exists():
+            raise NotConfigured("PROXY_LIST не задан или файл не найден")
+        proxies = load_proxy_list(proxy_list)
+        if not proxies:
+            # Пустому пулу нечего выбирать: запросы идут без прокси
+            raise NotConfigured(f"В {proxy_list} нет ни одного прокси")
+
+        pool = ProxyPool(
+            proxies,
+            max_failures=settings.getint("PROXY_POOL_MAX_FAILURES", 3),
+            backoff_base=settings.getfloat("PROXY_POOL_BACKOFF_BASE", 30),
+            backoff_max=settings.getfloat("PROXY_POOL_BACKOFF_MAX", 3600),
+        )
+        state_path = settings.get("PROXY_POOL_STATE_FILE")
+        if state_path:
+            pool.load(state_path)
+
+        failure_codes = set(settings.getlist("RETRY_HTTP_CODES")) | {429}
+        s = cls(pool, crawler.stats, {int(code) for code in failure_codes}, state_path)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        if "proxy" in request.meta and "proxy_pool" not in request.meta:
+            return None
+
+        proxy = self.pool.choose()
+        request.meta["proxy"] = proxy
+        request.meta["proxy_pool"] = proxy
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        proxy = request.meta.get("proxy_pool")
+        # Ответы из HTTP-кэша через прокси не ходили
+        if proxy and "cached" not in response.flags:
+            latency = request.meta.get("download_latency")
+            if response.status in self.failure_codes:
+                self.failed(proxy, f"http_{response.status}", latency)
+            else:
+                self.pool.success(proxy, latency)
+                self.stats.inc_value("proxy_pool/success")
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        proxy = request.meta.get("proxy_pool")
+        if proxy:
+            self.failed(proxy, type(exception).__name__)
+        # Повтор запроса остаётся за RetryMiddleware
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def failed(self, proxy, cause, latency=None):
+        self.stats.inc_value(f"proxy_pool/failure/{cause}")
+        if self.pool.failure(proxy, latency):
+            self.stats.inc_value("proxy_pool/quarantined")
+        self.stats.set_value("proxy_pool/healthy", self.pool.healthy_count())
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        self.stats.set_value("proxy_pool/size", len(self.pool.states))
+        self.stats.set_value("proxy_pool/healthy", self.pool.healthy_count())
+
+    def spider_closed(self, spider):
+        self.stats.set_value("proxy_pool/healthy", self.pool.healthy_count())
+        if self.state_path:
+            self.pool.save(self.state_path)
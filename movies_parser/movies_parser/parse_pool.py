@@ -0,0 +1,61 @@
+# Process pool for HTML extraction
+#
+# Parsing an article takes milliseconds of CPU on the reactor thread, so with
+# fast downloads a crawl is bound to one core. ParsePool sends the response
+# body to worker processes and returns the extracted dict through a Deferred.
+# At most PARSE_POOL_MAX_PENDING pages wait for the pool at a time; responses
+# waiting for a free slot stay in the scraper, and once their size exceeds
+# SCRAPER_SLOT_MAX_ACTIVE_SIZE the engine stops taking requests from the
+# scheduler, so a slow pool throttles downloads instead of piling up bodies.
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class ParsePool:
+    def __init__(self, workers, max_pending=0, stats=None):
+        self.workers = workers
+        # spawn, а не fork: форк процесса с запущенным реактором и потоками небезопасен
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.semaphore = defer.DeferredSemaphore(max_pending or 2 * workers)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            workers=settings.getint("PARSE_POOL_WORKERS"),
+            max_pending=settings.getint("PARSE_POOL_MAX_PENDING"),
+            stats=crawler.stats,
+        )
+
+    def submit(self, function, *args):
+        """Выполняет function(*args) в пуле; Deferred с результатом."""
+        if self.stats is not None:
+            self.stats.inc_value("parse_pool/submitted")
+            self.stats.max_value("parse_pool/max_waiting", len(self.semaphore.waiting) + 1)
+        return self.semaphore.run(self._submit, function, *args)
+
+    def _submit(self, function, *args):
+        # Импорт здесь: установленный при импорте модуля реактор помешал бы Scrapy поставить asyncio
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+        future = self.executor.submit(function, *args)
+        # Колбэк future вызывается в служебном потоке пула, результат передаём в поток реактора
+        future.add_done_callback(lambda done: reactor.callFromThread(self._resolve, d, done))
+        return d
+
+    @staticmethod
+    def _resolve(d, future):
+        if future.cancelled():
+            d.cancel()
+        elif future.exception() is not None:
+            d.errback(Failure(future.exception()))
+        else:
+            d.callback(future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
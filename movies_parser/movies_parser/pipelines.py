@@ -2,12 +2,15 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-import csv
-from pathlib import Path
+import time
 
-import pandas as pd
-from itemadapter import ItemAdapter  # noqa: F401
+from itemadapter import ItemAdapter
 from scrapy.exceptions import DropItem
+from twisted.internet import task
+
+from movies_parser.instrumentation import StageStats
+from movies_parser.items import RatingUpdate
+from movies_parser.writers import open_writer
 
 
 class DuplicateItemError(DropItem):
@@ -16,48 +19,104 @@ class DuplicateItemError(DropItem):
 
 
 class DuplicatePipeline:
-    def __init__(self):
-        self.titles_seen = set()
+    def __init__(self, incremental=False):
+        self.incremental = incremental
+        self.titles_seen = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.getbool("INCREMENTAL_RECRAWL"))
 
-    def open_spider(self, spider):  # noqa: ARG002
-        try:
-            df = pd.read_csv('movies.csv', encoding='utf-8')
-            self.titles_seen = set(df['title'].tolist())
-        except FileNotFoundError:
-            self.titles_seen = set()
+    def open_spider(self, spider):
+        # Индекс открывает паук, чтобы не загружать его дважды
+        self.titles_seen = spider.titles_seen
 
     def process_item(self, item, spider):  # noqa: ARG002
-        if item['title'] in self.titles_seen:
-            raise DuplicateItemError(item['title'])
+        adapter = ItemAdapter(item)
+        # Рейтинг (инкрементальный обход, повтор из dead-letter) обновляет уже сохранённую строку
+        if isinstance(item, RatingUpdate):
+            if not self.titles_seen.stored(adapter['title']):
+                raise DropItem(f"Нет сохранённого фильма для обновления рейтинга: '{adapter['title']}'")
+            return item
+        # При инкрементальном обходе уже сохранённый фильм - это обновление строки, а не дубликат
+        if self.incremental and self.titles_seen.stored(adapter['title']):
+            return item
+        if adapter['title'] in self.titles_seen:
+            raise DuplicateItemError(adapter['title'])
 
-        self.titles_seen.add(item['title'])
+        self.titles_seen.add(adapter['title'], adapter.get('revid'), adapter.get('imdb_id'),
+                             adapter.get('rating_updated_at'))
         return item
 
 
 class MoviesParserPipeline:
-    def __init__(self):
-        self.file = None
+    def __init__(self, settings, stats=None):
+        self.settings = settings
+        self.stage_stats = StageStats(stats) if stats is not None else None
+        self.batch_size = settings.getint("OUTPUT_BATCH_SIZE", 500)
+        self.flush_interval = settings.getfloat("OUTPUT_FLUSH_INTERVAL", 30)
         self.writer = None
+        self.buffer = []
+        self.flush_timer = None
+        self.titles_seen = None
+        self.incremental = settings.getbool("INCREMENTAL_RECRAWL")
+        self.stats = stats
+        # Обновления уже сохранённых фильмов: название -> поля; применяются одним проходом при закрытии
+        self.updates = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
 
-    def open_spider(self, spider):  # noqa: ARG002
-        self.file = Path('movies.csv').open('a+', newline='', encoding='utf-8')  # noqa: SIM115
-        self.writer = csv.writer(self.file)
+    def open_spider(self, spider):
+        self.titles_seen = spider.titles_seen
+        self.writer = open_writer(self.settings)
 
-        if self.file.tell() == 0:
-            self.writer.writerow(['title', 'original_title', 'genre', 'director', 'country', 'year', 'imdb_rating'])
+        # Сбрасываем пакет по таймеру, даже если новых фильмов давно не было
+        if self.flush_interval > 0:
+            self.flush_timer = task.LoopingCall(self.flush)
+            self.flush_timer.start(self.flush_interval, now=False)
 
     def process_item(self, item, spider):  # noqa: ARG002
+        adapter = ItemAdapter(item)
+        if (self.incremental or isinstance(item, RatingUpdate)) and self.titles_seen.stored(adapter['title']):
+            # Обновление может быть частичным (RatingUpdate): храним только его поля
+            self.updates.setdefault(adapter['title'], {}).update(adapter.asdict())
+            return item
 
-        self.writer.writerow([
-            item['title'],
-            item['original_title'],
-            item['genre'],
-            item['director'],
-            item['country'],
-            item['year'],
-            item['imdb_rating'],
-        ])
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
         return item
 
+    def flush(self):
+        """Записывает накопленный пакет целиком."""
+        if not self.buffer:
+            return
+        started = time.perf_counter()
+        self.writer.write_batch(self.buffer)
+        if self.stage_stats:
+            self.stage_stats.record("pipeline_write", time.perf_counter() - started)
+        self.buffer = []
+        # Названия попадают в индекс только после записи пакета
+        self.titles_seen.commit()
+
     def close_spider(self, spider):  # noqa: ARG002
-        self.file.close()
+        if self.flush_timer and self.flush_timer.running:
+            self.flush_timer.stop()
+        self.flush()
+        if self.updates:
+            self.apply_updates()
+        self.writer.close()
+
+    def apply_updates(self):
+        """Применяет обновления к файлу результатов, затем сохраняет их revid и время рейтинга в индекс."""
+        started = time.perf_counter()
+        self.writer.upsert(self.updates)
+        if self.stage_stats:
+            self.stage_stats.record("pipeline_upsert", time.perf_counter() - started)
+            self.stats.set_value("incremental/upserted", len(self.updates))
+        for title, update in self.updates.items():
+            self.titles_seen.add(title, update.get('revid'), update.get('imdb_id'), update.get('rating_updated_at'))
+        self.titles_seen.commit()
+        self.updates = {}
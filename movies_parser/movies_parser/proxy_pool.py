@@ -0,0 +1,108 @@
+# Health-scored proxy pool
+#
+# Each proxy keeps an exponentially weighted moving average (EWMA) of its
+# latency and success rate. Proxies are picked at random with probability
+# proportional to success / latency, and a proxy that keeps failing is
+# quarantined with exponential backoff. Scores survive restarts in a JSON file.
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+# Вес нового наблюдения в скользящих средних
+EWMA_ALPHA = 0.3
+# Начальные оценки для прокси без истории
+INITIAL_LATENCY = 2.0
+INITIAL_SUCCESS = 0.5
+# Нижняя граница веса, чтобы плохие прокси иногда проверялись снова
+MIN_WEIGHT = 0.01
+
+
+def load_proxy_list(path):
+    """Читает список прокси: по одному на строку, пустые строки и # комментарии пропускаются."""
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+
+class ProxyState:
+    __slots__ = ("latency", "success", "failures", "quarantined_until", "requests")
+
+    def __init__(self, latency=INITIAL_LATENCY, success=INITIAL_SUCCESS, failures=0, quarantined_until=0.0,
+                 requests=0):
+        self.latency = latency
+        self.success = success
+        # Подряд идущие ошибки
+        self.failures = failures
+        self.quarantined_until = quarantined_until
+        self.requests = requests
+
+    def weight(self):
+        return max(self.success / max(self.latency, 0.05), MIN_WEIGHT)
+
+
+class ProxyPool:
+    def __init__(self, proxies, max_failures=3, backoff_base=30, backoff_max=3600):
+        self.states = {proxy: ProxyState() for proxy in proxies}
+        self.max_failures = max_failures
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def choose(self, now=None):
+        """Выбирает прокси, взвешенно по оценке, среди не находящихся в карантине."""
+        now = now or time.time()
+        healthy = [(proxy, state) for proxy, state in self.states.items() if state.quarantined_until <= now]
+        if not healthy:
+            # Все в карантине: берём тот, чей карантин кончается раньше
+            return min(self.states, key=lambda proxy: self.states[proxy].quarantined_until)
+        proxies, states = zip(*healthy)
+        return random.choices(proxies, weights=[state.weight() for state in states])[0]
+
+    def success(self, proxy, latency):
+        state = self.states.get(proxy)
+        if state is None:
+            return
+        state.requests += 1
+        state.failures = 0
+        state.quarantined_until = 0.0
+        state.success += EWMA_ALPHA * (1 - state.success)
+        if latency is not None:
+            state.latency += EWMA_ALPHA * (latency - state.latency)
+
+    def failure(self, proxy, latency=None, now=None):
+        """Учитывает ошибку; возвращает True, если прокси отправлен в карантин."""
+        state = self.states.get(proxy)
+        if state is None:
+            return False
+        state.requests += 1
+        state.failures += 1
+        state.success -= EWMA_ALPHA * state.success
+        if latency is not None:
+            state.latency += EWMA_ALPHA * (latency - state.latency)
+        if state.failures < self.max_failures:
+            return False
+
+        # Экспоненциальная задержка: каждая следующая ошибка подряд удваивает карантин
+        backoff = min(self.backoff_base * 2 ** (state.failures - self.max_failures), self.backoff_max)
+        state.quarantined_until = (now or time.time()) + backoff
+        return True
+
+    def healthy_count(self, now=None):
+        now = now or time.time()
+        return sum(1 for state in self.states.values() if state.quarantined_until <= now)
+
+    def load(self, path):
+        """Восстанавливает оценки прокси, которые есть в текущем списке."""
+        if not Path(path).exists():
+            return
+        saved = json.loads(Path(path).read_text(encoding="utf-8"))
+        for proxy, values in saved.items():
+            if proxy in self.states:
+                self.states[proxy] = ProxyState(**values)
+
+    def save(self, path):
+        data = {proxy: {slot: getattr(state, slot) for slot in ProxyState.__slots__}
+                for proxy, state in self.states.items()}
+        tmp_path = f"{path}.tmp"
+        Path(tmp_path).write_text(json.dumps(data, indent=1), encoding="utf-8")
+        os.replace(tmp_path, path)
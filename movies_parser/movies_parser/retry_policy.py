@@ -0,0 +1,164 @@
+# Bounded, classified retries for broken Wikipedia and IMDb pages
+#
+# A page that came back without the content the callback expects is
+# classified (proxy garbage, captcha, real 404, missing infobox) and retried
+# within a per-class budget. The retry goes back through the scheduler after a
+# jittered exponential backoff. Requests that exhaust their budget are appended
+# to a dead-letter file and can be replayed with `scrapy crawl movies -a replay=<file>`.
+import dataclasses
+import json
+import random
+import time
+from pathlib import Path
+
+from scrapy import Request
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+from movies_parser import items
+
+PROXY_GARBAGE = "proxy_garbage"
+CAPTCHA = "captcha"
+NOT_FOUND = "not_found"
+MISSING_INFOBOX = "missing_infobox"
+DOWNLOAD_ERROR = "download_error"
+
+DEFAULT_BUDGETS = {
+    PROXY_GARBAGE: 5,
+    CAPTCHA: 3,
+    NOT_FOUND: 0,
+    MISSING_INFOBOX: 1,
+    DOWNLOAD_ERROR: 0,
+}
+
+CAPTCHA_MARKERS = ("captcha", "awswaf", "challenge-platform", "are you a robot")
+
+# Признаки настоящей страницы сайта: если они есть в ответе 404, страницы действительно нет
+GENUINE_404_MARKERS = {
+    "wikipedia.org": '"wgArticleId":0',
+    "imdb.com": 'id="home_img_holder"',
+}
+
+
+def classify(response):
+    """Определяет, почему страница пришла без ожидаемого содержимого."""
+    head = response.text[:200_000].lower()
+    if response.status == 429 or any(marker in head for marker in CAPTCHA_MARKERS):
+        return CAPTCHA
+    if response.status == 404:
+        marker = next((m for domain, m in GENUINE_404_MARKERS.items() if domain in response.url), None)
+        if marker and marker.lower() in head:
+            return NOT_FOUND
+    return PROXY_GARBAGE
+
+
+def to_json(value):
+    """Элементы (dataclass) в cb_kwargs сохраняются словарём с именем класса, прочее - строкой."""
+    if dataclasses.is_dataclass(value):
+        return {"__item__": type(value).__name__, **dataclasses.asdict(value)}
+    return str(value)
+
+
+def from_json(obj):
+    name = obj.pop("__item__", None)
+    return getattr(items, name)(**obj) if name else obj
+
+
+class RetryPolicy:
+    def __init__(self, crawler, budgets, backoff_base, backoff_max, dead_letter_path):
+        self.crawler = crawler
+        self.budgets = {**DEFAULT_BUDGETS, **budgets}
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letter_path = dead_letter_path
+        # Повторы, ожидающие своей задержки (паук не должен закрыться раньше)
+        self.delayed = 0
+
+    @property
+    def stats(self):
+        # Политику создаёт паук, а crawler.stats появляется уже после него
+        return self.crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        policy = cls(
+            crawler,
+            budgets=settings.getdict("RETRY_POLICY_BUDGETS"),
+            backoff_base=settings.getfloat("RETRY_POLICY_BACKOFF_BASE", 2),
+            backoff_max=settings.getfloat("RETRY_POLICY_BACKOFF_MAX", 60),
+            dead_letter_path=settings.get("RETRY_DEAD_LETTER_FILE"),
+        )
+        crawler.signals.connect(policy.spider_idle, signal=signals.spider_idle)
+        return policy
+
+    def attempts(self, request, failure_class):
+        return request.meta.get("retry_policy", {}).get(failure_class, 0)
+
+    def can_retry(self, request, failure_class):
+        return self.attempts(request, failure_class) < self.budgets.get(failure_class, 0)
+
+    def retry(self, request, failure_class, spider):
+        """Планирует повтор запроса; возвращает False, если бюджет исчерпан (запрос в dead-letter)."""
+        attempts = self.attempts(request, failure_class)
+        self.stats.inc_value(f"retry_policy/{failure_class}/seen")
+        if attempts >= self.budgets.get(failure_class, 0):
+            self.stats.inc_value(f"retry_policy/{failure_class}/exhausted")
+            spider.logger.warning(f"Повторы исчерпаны ({failure_class}, {attempts}): {request.url}")
+            self.dead_letter(request, failure_class, attempts)
+            return False
+
+        counters = {**request.meta.get("retry_policy", {}), failure_class: attempts + 1}
+        retry_request = request.replace(dont_filter=True, meta={**request.meta, "retry_policy": counters})
+        # Полный джиттер: случайная задержка до base * 2^attempts
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempts))
+        self.stats.inc_value(f"retry_policy/{failure_class}/retried")
+        self.delayed += 1
+        # Импорт здесь: установленный при импорте модуля реактор помешал бы Scrapy поставить asyncio
+        from twisted.internet import reactor
+
+        reactor.callLater(delay, self.schedule, retry_request)
+        return True
+
+    def schedule(self, request):
+        self.delayed -= 1
+        self.crawler.engine.crawl(request)
+
+    def dead_letter(self, request, failure_class, attempts):
+        if not self.dead_letter_path:
+            return
+        record = {
+            "time": time.time(),
+            "url": request.url,
+            "method": request.method,
+            "body": request.body.decode("utf-8"),
+            "callback": getattr(request.callback, "__name__", None),
+            "failure_class": failure_class,
+            "attempts": attempts,
+            "cb_kwargs": request.cb_kwargs,
+            "meta": {key: request.meta[key] for key in ("frontier",) if key in request.meta},
+        }
+        with Path(self.dead_letter_path).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=to_json) + "\n")
+
+    def spider_idle(self, spider):
+        if self.delayed:
+            raise DontCloseSpider
+
+
+def replay_requests(path, spider):
+    """Запросы из dead-letter файла, с обнулёнными счётчиками повторов."""
+    with Path(path).open(encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line, object_hook=from_json)
+            callback = getattr(spider, record["callback"] or "parse")
+            yield Request(
+                url=record["url"],
+                method=record.get("method", "GET"),
+                body=record.get("body", ""),
+                headers={"Content-Type": "application/x-www-form-urlencoded"} if record.get("body") else None,
+                callback=callback,
+                cb_kwargs=record.get("cb_kwargs") or {},
+                meta={**(record.get("meta") or {}), "replay": True},
+                dont_filter=True,
+            )
@@ -0,0 +1,90 @@
+# Persistent index of already scraped movie titles
+#
+# Titles are stored as 64-bit BLAKE2b hashes in a SQLite table (the hash is the
+# rowid, so a row costs a few bytes on disk and nothing in memory). The spider
+# uses the index to skip known movie links and DuplicatePipeline uses it to
+# drop duplicate items; it is updated incrementally as items are written.
+# For the incremental recrawl each row also keeps the Wikipedia revision id,
+# the IMDb ID and the time the rating was fetched.
+import csv
+import hashlib
+import sqlite3
+from pathlib import Path
+
+
+def title_hash(title):
+    """64-битный хэш названия (знаковый, чтобы поместиться в INTEGER SQLite)."""
+    digest = hashlib.blake2b(title.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class SeenTitles:
+    def __init__(self, path, csv_path=None):
+        # Названия, принятые пайплайном, но ещё не записанные в файл результатов: название -> метаданные
+        self.pending = {}
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS titles (hash INTEGER PRIMARY KEY, revid INTEGER, imdb_id TEXT, rating_at REAL)"
+        )
+        # Индексы из прошлых версий хранили только хэши
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(titles)")}
+        for column, column_type in (("revid", "INTEGER"), ("imdb_id", "TEXT"), ("rating_at", "REAL")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE titles ADD COLUMN {column} {column_type}")
+
+        if csv_path and not len(self) and Path(csv_path).exists():
+            self.import_csv(csv_path)
+
+    @classmethod
+    def from_crawler(cls, crawler, csv_path=None):
+        return cls(crawler.settings.get("SEEN_TITLES_PATH", "movies.seen.sqlite"), csv_path)
+
+    def import_csv(self, csv_path):
+        """Однократно заполняет индекс из существующего CSV с результатами (потоково, без pandas)."""
+        with Path(csv_path).open(newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            self.db.executemany(
+                "INSERT OR IGNORE INTO titles (hash) VALUES (?)",
+                ((title_hash(row["title"]),) for row in reader if row.get("title")),
+            )
+        self.db.commit()
+
+    def __contains__(self, title):
+        return title in self.pending or self.stored(title)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM titles").fetchone()[0]
+
+    def stored(self, title):
+        """Название уже записано в файл результатов в одном из прошлых пакетов или запусков."""
+        return self.db.execute("SELECT 1 FROM titles WHERE hash = ?", (title_hash(title),)).fetchone() is not None
+
+    def revision(self, title):
+        """Метаданные сохранённой строки: (revid, imdb_id, rating_at), или None, если названия нет."""
+        return self.db.execute(
+            "SELECT revid, imdb_id, rating_at FROM titles WHERE hash = ?", (title_hash(title),),
+        ).fetchone()
+
+    def add(self, title, revid=None, imdb_id=None, rating_at=None):
+        """Отмечает название как принятое; в индекс оно попадёт после записи в файл (commit)."""
+        self.pending[title] = (revid, imdb_id, rating_at)
+
+    def commit(self):
+        """Сохраняет названия, записанные в файл результатов; неизвестные (None) поля не затираются."""
+        if self.pending:
+            self.db.executemany(
+                "INSERT INTO titles VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO UPDATE SET "
+                "revid = coalesce(excluded.revid, revid), "
+                "imdb_id = coalesce(excluded.imdb_id, imdb_id), "
+                "rating_at = coalesce(excluded.rating_at, rating_at)",
+                ((title_hash(title), *meta) for title, meta in self.pending.items()),
+            )
+            self.db.commit()
+            self.pending.clear()
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -1,14 +1,57 @@
 import re
-from pathlib import Path
+import resource
+import time
 from typing import Any
 from typing import ClassVar
 
-import pandas as pd
-import requests
 import scrapy
 from bs4 import BeautifulSoup
+from scrapy import FormRequest
 from scrapy import Request
+from scrapy import signals
+from scrapy.http import HtmlResponse
 import urllib.parse
+from w3lib.url import safe_url_string
+
+from movies_parser import wikidata
+
+from movies_parser.backpressure import CrawlBackpressure
+from movies_parser.backpressure import peak_rss_mb
+from movies_parser.category_shards import ShardCoverage
+from movies_parser.category_shards import check_boundaries
+from movies_parser.category_shards import page_cursor
+from movies_parser.category_shards import reached_boundary
+from movies_parser.category_shards import shard_boundaries
+from movies_parser.category_shards import shard_start_url
+from movies_parser.crawl_state import CrawlState
+from movies_parser.httpcache import page_revid
+from movies_parser.imdb_cache import ImdbCache
+from movies_parser.imdb_cache import imdb_id_from_link
+from movies_parser.imdb_datasets import ImdbRatings
+from movies_parser.imdb_titles import ImdbTitles
+from movies_parser.infobox import Infobox
+from movies_parser.items import MoviesParserItem
+from movies_parser.items import RatingUpdate
+from movies_parser.items import normalize_imdb_id
+from movies_parser.items import normalize_rating
+from movies_parser.parse_pool import ParsePool
+from movies_parser.retry_policy import DOWNLOAD_ERROR
+from movies_parser.retry_policy import MISSING_INFOBOX
+from movies_parser.retry_policy import NOT_FOUND
+from movies_parser.retry_policy import RetryPolicy
+from movies_parser.retry_policy import classify
+from movies_parser.retry_policy import replay_requests
+from movies_parser.seen_titles import SeenTitles
+from movies_parser.writers import output_path
+
+# Метки инфобокса, из которых берётся год выхода (в порядке приоритета)
+YEAR_LABELS = ("Год", "Дата выхода", "Первый показ", "Дата премьеры")
+
+# Приоритеты запросов: сначала дозапрашиваются рейтинги начатых фильмов, затем статьи
+# и пакеты API, и только потом новые страницы категории (у них приоритет 0)
+MOVIE_PRIORITY = 10
+IMDB_PRIORITY = 20
+
 
 def clean_text(text):
     """Удаляет сноски и лишние пробелы."""
@@ -27,11 +70,9 @@ def get_infobox_value(label, infobox):
     """Функция для извлечения одиночных значений из инфобокса."""
     if not infobox:
         return None
-    row = infobox.find("th", string=re.compile(label))
-    if row:
-        value = row.find_next_sibling("td")
-        if value:
-            return clean_text(value.text)
+    value = infobox.cell(label)
+    if value:
+        return clean_text(value.text)
     return None
 
 
@@ -39,19 +80,17 @@ def get_infobox_imdb_link(infobox):
     """Функция для извлечения ссылки на IMDB из инфобокса."""
     if not infobox:
         return None
-    row = infobox.find("th", string=re.compile("IMDb"))
-    if row:
-        value = row.find_next_sibling("td")
-        if value:
-            href = value.find("a").get("href")
-            if not href.startswith("https://www.imdb.com/title/"):
-                # Ищем текст в value начинающийся с 'ID'
-                imdb_id = re.findall(r"ID\s(\d+)", value.text)
-                if not imdb_id:
-                    imdb_id = re.findall(r"ID(\d+)", value.text)
-                if imdb_id:
-                    return f"https://www.imdb.com/title/tt{imdb_id[-1]}/"
-            return href
+    value = infobox.cell("IMDb")
+    if value:
+        href = value.links[0][1] if value.links else None
+        if not href or not href.startswith("https://www.imdb.com/title/"):
+            # Ищем текст в value начинающийся с 'ID'
+            imdb_id = re.findall(r"ID\s(\d+)", value.text)
+            if not imdb_id:
+                imdb_id = re.findall(r"ID(\d+)", value.text)
+            if imdb_id:
+                return f"https://www.imdb.com/title/tt{imdb_id[-1]}/"
+        return href
     return None
 
 
@@ -59,19 +98,15 @@ def get_list_from_infobox(label, infobox):
     """Функция для извлечения списка значений из инфобокса."""
     if not infobox:
         return []
-    row = infobox.find("th", string=re.compile(label))
-    if not row:
-        return []
-
-    td = row.find_next_sibling("td")
+    td = infobox.cell(label)
     if not td:
         return []
 
     # Пытаемся извлечь ссылки
-    items = [a.text for a in td.find_all("a") if a.text.strip()]
+    items = [text for text, _ in td.links if text.strip()]
     if not items:
         # Пытаемся извлечь списки, если строки разделены тегом </br> то преобразуем в список
-        items = [", ".join(s.stripped_strings) for s in td.find_all("span") if s.text.strip()]
+        items = td.spans
 
     # Удаляем ссылки
     return remove_refs(items)
@@ -82,18 +117,8 @@ def get_original_title(title, infobox):
     if not infobox:
         return None
 
-    rows = infobox.find_all("tr")
-    original_title = None
-
-    # Проверяем вторую строку (если она есть)
-    if len(rows) > 1:
-        second_row = rows[1].find("td", {"colspan": "2"})
-        if second_row:  # noqa: SIM102
-            # Проверяем, что это не заголовок (<th>) и не изображение (<img>)
-            if not rows[1].find("th") and not second_row.find("img"):
-                deepest_span = second_row.find_all("span")  # Находим последний <span>
-                if deepest_span:
-                    original_title = deepest_span[-1].get_text(strip=True)
+    # Вторая строка таблицы (если это не заголовок и не изображение)
+    original_title = infobox.subtitle
 
     if not original_title:
         # Если оригинального названия нет, то пытаемся извлечь его из названия
@@ -109,162 +134,734 @@ def get_original_title(title, infobox):
     return original_title
 
 
+IMDB_LOGO_PATTERN = re.compile(rb"""id=["']?home_img_holder\b""")
+IMDB_RATING_PATTERNS = (
+    # schema.org в <script type="application/ld+json">, он в <head> в начале страницы
+    re.compile(rb'"aggregateRating":\{[^{}]*?"ratingValue":"?(\d+(?:\.\d+)?)'),
+    # Данные Next.js (__NEXT_DATA__) в конце страницы
+    re.compile(rb'"ratingsSummary":\{"aggregateRating":(\d+(?:\.\d+)?)'),
+    # Блок рейтинга в разметке, если встроенных данных нет
+    re.compile(rb'data-testid="hero-rating-bar__aggregate-rating__score"[^>]*><span[^>]*>(\d+(?:[.,]\d+)?)'),
+)
+
+
+def get_imdb_rating(response):
+    """Возвращает пару (это страница IMDb, рейтинг или None).
+
+    Страница не разбирается в DOM: логотип и рейтинг ищутся регулярными
+    выражениями по байтам, поиск останавливается на первом совпадении.
+    """
+    # Проверяем, действительно ли мы на IMDb (логотип IMDb в шапке)
+    if not IMDB_LOGO_PATTERN.search(response.body):
+        return False, None
+
+    for pattern in IMDB_RATING_PATTERNS:
+        match = pattern.search(response.body)
+        if match:
+            return True, match.group(1).decode().replace(",", ".")
+    return True, None
+
+
+def get_category_links(response, backend="selector"):
+    """Возвращает пары (текст, href) ссылок на фильмы со страницы категории."""
+    if backend == "bs4":
+        soup = BeautifulSoup(response.text, "lxml")
+        columns = soup.find("div", {"class": "mw-category-columns"})
+        return [(a.text, a.get("href")) for a in columns.find_all("a")]
+
+    return [(link.root.text_content(), link.root.get("href"))
+            for link in response.css("div.mw-category-columns a")]
+
+
+def get_title_and_infobox(response, backend="selector"):
+    """Возвращает заголовок страницы и проиндексированный инфобокс (или None)."""
+    if backend == "bs4":
+        soup = BeautifulSoup(response.text, "html.parser")
+        title_element = soup.find("h1", class_="firstHeading")
+        table = soup.find("table", class_="infobox")
+        title = title_element.text.strip() if title_element else None
+        return title, Infobox.from_soup(table) if table else None
+
+    # Разбираем только заголовок и поддерево инфобокса из уже построенного lxml-дерева ответа
+    title_element = response.css("h1.firstHeading")
+    table = response.css("table.infobox")
+    title = title_element[0].root.text_content().strip() if title_element else None
+    return title, Infobox.from_selector(table[0]) if table else None
+
+
+def extract_movie(response, backend="selector"):
+    """Извлекает данные о фильме из статьи; None, если это не страница Википедии."""
+    # Заголовок страницы и инфобокс (таблица с данными о фильме), индексируется за один проход
+    title, infobox = get_title_and_infobox(response, backend)
+    if title is None:
+        return None
+
+    # Год выхода
+    year = None
+    for label in YEAR_LABELS:
+        year = get_infobox_value(label, infobox)
+        if year:
+            break
+    if year:
+        match = re.search(r"\b\d{4}\b", year)
+        year = match.group(0) if match else None
+
+    return {
+        'title': title,
+        'original_title': get_original_title(title, infobox),
+        # Жанр, страна и режиссёр
+        'genre': get_list_from_infobox("Жанр", infobox),
+        'country': get_list_from_infobox("Стран", infobox),
+        'director': get_list_from_infobox("Режиссёр", infobox),
+        'year': year,
+        'imdb_link': get_infobox_imdb_link(infobox),
+        'revid': page_revid(response.body),
+        'has_infobox': infobox is not None,
+    }
+
+
+def extract_movie_from_body(body, url, encoding, backend="selector"):
+    """extract_movie для пула процессов: принимает и возвращает только простые типы."""
+    return extract_movie(HtmlResponse(url=url, body=body, encoding=encoding), backend)
+
+
 class MoviesSpider(scrapy.Spider):
     name = "movies"
-    allowed_domains: ClassVar[list[str]] = ["ru.wikipedia.org"]
+    allowed_domains: ClassVar[list[str]] = ["ru.wikipedia.org", "wikidata.org", "imdb.com"]
     start_urls: ClassVar[list[str]] = [
         "https://ru.wikipedia.org/wiki/Категория:Фильмы_по_алфавиту",
     ]
 
     def __init__(self, **kwargs: Any):
+        # Файл dead-letter для повторной обработки: scrapy crawl movies -a replay=dead_letter.jsonl
+        self.replay = kwargs.pop("replay", None)
         super().__init__(**kwargs)
+        self.imdb_cache = None
+        self.imdb_ratings = None
+        self.imdb_titles = None
+        self.imdb_match_min_confidence = 0.8
+        self.crawl_state = None
+        self.backpressure = None
+        self.shard_boundaries = []
+        self.shard_coverage = None
+        self.parser_backend = "selector"
+        self.extraction_engine = "html"
+        self.api_batch_size = wikidata.MAX_BATCH_SIZE
+        # Подписи жанров, людей и стран из Wikidata: QID -> название
+        self.wikidata_labels = {}
         self.titles_seen = None
+        self.startup_stats = {}
+        self.retry_policy = None
+        self.parse_pool = None
+        self.incremental = False
+        self.rating_max_age = 7 * 24 * 3600
         self.filepath = 'movies.csv'
 
-        if Path(self.filepath).exists():
-            df = pd.read_csv(self.filepath, encoding='utf-8')
-            self.titles_seen = set(df['title'].tolist())
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.parser_backend = crawler.settings.get("PARSER_BACKEND", "selector")
+        spider.extraction_engine = crawler.settings.get("EXTRACTION_ENGINE", "html")
+        spider.api_batch_size = min(crawler.settings.getint("API_BATCH_SIZE", wikidata.MAX_BATCH_SIZE),
+                                    wikidata.MAX_BATCH_SIZE)
+        spider.retry_policy = RetryPolicy.from_crawler(crawler)
+        if crawler.settings.getint("PARSE_POOL_WORKERS"):
+            spider.parse_pool = ParsePool.from_crawler(crawler)
+            crawler.signals.connect(spider.parse_pool.close, signal=signals.spider_closed)
+        spider.incremental = crawler.settings.getbool("INCREMENTAL_RECRAWL")
+        spider.rating_max_age = crawler.settings.getfloat("INCREMENTAL_RATING_MAX_AGE", 7 * 24 * 3600)
+
+        # Общий с DuplicatePipeline индекс уже собранных фильмов
+        started = time.perf_counter()
+        spider.filepath = output_path(crawler.settings)
+        csv_output = spider.filepath if crawler.settings.get("OUTPUT_FORMAT", "csv") == "csv" else None
+        spider.titles_seen = SeenTitles.from_crawler(crawler, csv_output)
+        crawler.signals.connect(spider.titles_seen.close, signal=signals.spider_closed)
+        open_seconds = time.perf_counter() - started
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        spider.startup_stats = {
+            "seen_titles/open_seconds": round(open_seconds, 3),
+            "seen_titles/startup_rss_mb": round(rss_mb, 1),
+        }
+        spider.logger.info(
+            f"Индекс собранных фильмов: {len(spider.titles_seen)} названий, "
+            f"открыт за {open_seconds:.3f} с, RSS {rss_mb:.1f} МБ"
+        )
+        if crawler.settings.getbool("IMDB_CACHE_ENABLED"):
+            spider.imdb_cache = ImdbCache.from_crawler(crawler)
+            crawler.signals.connect(spider.imdb_cache.close, signal=signals.spider_closed)
+        if crawler.settings.get("IMDB_RATINGS_DATASET"):
+            spider.imdb_ratings = ImdbRatings.from_crawler(crawler)
+            spider.logger.info(f"Датасет рейтингов IMDb: {len(spider.imdb_ratings)} фильмов")
+        if crawler.settings.get("IMDB_TITLES_BASICS"):
+            spider.imdb_titles = ImdbTitles.from_crawler(crawler, spider.imdb_ratings)
+            spider.imdb_match_min_confidence = crawler.settings.getfloat("IMDB_MATCH_MIN_CONFIDENCE", 0.8)
+            crawler.signals.connect(spider.imdb_titles.close, signal=signals.spider_closed)
+            spider.logger.info(f"Индекс названий IMDb: {len(spider.imdb_titles)} фильмов")
+        if crawler.settings.getlist("CATEGORY_SHARD_BOUNDARIES"):
+            spider.shard_boundaries = check_boundaries(crawler.settings.getlist("CATEGORY_SHARD_BOUNDARIES"))
+        else:
+            spider.shard_boundaries = shard_boundaries(crawler.settings.getint("CATEGORY_SHARDS"))
+        if spider.shard_boundaries:
+            spider.shard_coverage = ShardCoverage(len(spider.shard_boundaries) + 1)
+            crawler.signals.connect(spider.check_shard_coverage, signal=signals.spider_closed)
+        if crawler.settings.get("CRAWL_STATE_FILE"):
+            spider.crawl_state = CrawlState.from_crawler(crawler)
+            crawler.signals.connect(spider.item_done, signal=signals.item_scraped)
+            crawler.signals.connect(spider.item_done, signal=signals.item_dropped)
+            crawler.signals.connect(spider.callback_failed, signal=signals.spider_error)
+            crawler.signals.connect(spider.crawl_state.close, signal=signals.spider_closed)
+        if crawler.settings.getint("CRAWL_MAX_PENDING_REQUESTS"):
+            spider.backpressure = CrawlBackpressure.from_crawler(crawler, spider.movie_request)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        return spider
+
+    def spider_opened(self):
+        """Паук создаётся раньше, чем crawler.stats: передаём статистику компонентам при открытии."""
+        for key, value in self.startup_stats.items():
+            self.crawler.stats.set_value(key, value)
+        if self.imdb_cache:
+            self.imdb_cache.stats = self.crawler.stats
+        if self.parse_pool:
+            self.parse_pool.stats = self.crawler.stats
+
+    def start_requests(self):
+        """Продолжаем прерванный обход с сохранённых курсоров, иначе начинаем с первой страницы."""
+        if self.replay:
+            self.logger.info(f"Повторная обработка запросов из {self.replay}")
+            yield from replay_requests(self.replay, self)
+            return
+
+        if not (self.crawl_state and self.crawl_state.resumable()):
+            if self.crawl_state:
+                # Прошлый обход завершён полностью, начинаем новый
+                self.crawl_state.cursors.clear()
+                # Курсоры всех фронтиров записываются до первых страниц: фронтир, первая страница
+                # которого так и не разобралась, при продолжении начнётся заново
+                for frontier, url in self.category_seeds():
+                    self.crawl_state.set_cursor(frontier, url)
+                self.crawl_state.save()
+
+            # Каждый фронтир начинается со своей буквы и обходится параллельно с остальными;
+            # неудачная первая страница, как и любая другая, попадает в dead-letter
+            for frontier, url in self.category_seeds():
+                yield self.category_request(url, frontier)
+            return
+
+        # Состояние, в котором нет курсора фронтира, например записанное с меньшим CATEGORY_SHARDS:
+        # такой фронтир начинается с первой страницы
+        for frontier, url in self.category_seeds():
+            self.crawl_state.cursors.setdefault(str(frontier), url)
+        self.logger.info(
+            f"Продолжаем обход: {len(self.crawl_state.pending)} фильмов в очереди, "
+            f"курсоры категории: {self.crawl_state.cursors}"
+        )
+        # Фильмы в очереди запрашиваются, даже если все фронтиры уже пройдены
+        for url in self.crawl_state.pending:
+            if self.backpressure:
+                self.backpressure.push(url)
+            else:
+                yield self.movie_request(url)
+        if self.backpressure:
+            yield from self.backpressure.requests(self.backpressure.page_requests)
+        for frontier, url in self.crawl_state.cursors.items():
+            if url:
+                yield self.category_request(url, int(frontier))
+
+    def category_request(self, url, frontier):
+        return Request(url=url, callback=self.parse, errback=self.download_failed, meta={'frontier': frontier},
+                       dont_filter=True)
+
+    def category_seeds(self):
+        """(номер фронтира, URL его первой страницы) для каждого фронтира категории."""
+        seeds = [(0, self.start_urls[0])]
+        for frontier, prefix in enumerate(self.shard_boundaries, start=1):
+            seeds.append((frontier, shard_start_url(self.start_urls[0], prefix)))
+        return seeds
+
+    def item_done(self, item):
+        """Фильм сохранён или отброшен, больше не считается незавершённым."""
+        self.crawl_state.movie_done(item.title)
+
+    def callback_failed(self, failure, response, spider):
+        """Исключение в колбэке: фильмы этого запроса уже не будут сохранены."""
+        self.movies_lost(response.request)
+
+    def movies_lost(self, request):
+        """Убирает из очереди состояния обхода фильмы, которые не будут сохранены.
+
+        Иначе они навсегда остались бы в crawl_state.json; для повторной
+        обработки они есть в dead-letter файле.
+        """
+        if not self.crawl_state or request is None:
+            return
+        kwargs = request.cb_kwargs
+        if 'movie' in kwargs:
+            self.crawl_state.movie_done(kwargs['movie'].title)
+        elif 'pages' in kwargs:
+            for _, url, _ in kwargs['pages'].values():
+                self.crawl_state.movie_failed(url)
+        elif 'urls' in kwargs:
+            for url in kwargs['urls'].values():
+                self.crawl_state.movie_failed(url)
         else:
-            df = pd.DataFrame(
-                columns=["title", "original_title", "genre", "director", "country", "year", "imdb_rating"]
+            # Страница могла быть получена через редирект, в очереди лежит исходный URL
+            self.crawl_state.movie_failed(request.meta.get('redirect_urls', [request.url])[0])
+
+    def closed(self, reason):
+        self.crawler.stats.set_value("memory/peak_rss_mb", round(peak_rss_mb()))
+
+    def check_shard_coverage(self):
+        """Предупреждает о возможных разрывах между фронтирами категории."""
+        gaps = self.shard_coverage.gaps()
+        self.crawler.stats.set_value("category/shards/gaps", len(gaps))
+        for frontier in gaps:
+            self.logger.warning(
+                f"Возможен пропуск фильмов перед фронтиром {frontier} "
+                f"(граница '{self.shard_boundaries[frontier - 1]}')"
             )
-            df.to_csv(self.filepath, index=False, encoding="utf-8-sig")
-            self.titles_seen = set()
 
     def parse(self, response):
         """Собираем ссылки на фильмы, и собираем данные."""
         if not response.css("div#mw-pages"):
-            self.logger.warning(f"Ошибка загрузки: {response.url}")
-            yield Request(url=response.url, callback=self.parse, dont_filter=True)
+            self.page_failed(response, classify(response))
+            return
 
-        soup = BeautifulSoup(response.text, "lxml")
-        columns = soup.find("div", {"class": "mw-category-columns"})
+        frontier = response.meta.get('frontier', 0)
 
+        links = get_category_links(response, self.parser_backend)
+        if self.shard_coverage:
+            self.shard_coverage.first_page(frontier, [text for text, _ in links])
 
         # Собираем ссылки на фильмы, которые еще не были собраны
-        new_list_of_links = [title_href
-                             for title_href in columns.find_all("a")
-                             if title_href.text not in self.titles_seen]
+        new_list_of_links = []
+        known_links = []
+        for text, href in links:
+            (known_links if text in self.titles_seen else new_list_of_links).append((text, href))
         if not new_list_of_links:
             print("="*79)
             print("NO NEW MOVIES FOUND ON PAGE: ", urllib.parse.unquote(response.url))
             print("="*79)
 
-        if new_list_of_links:
-            for _, movie_link in enumerate(new_list_of_links):
-                movie_link_full = "https://ru.wikipedia.org" + movie_link.get("href")
-                yield response.follow(movie_link_full, callback=self.parse_movie)
+        # Уже собранные фильмы при инкрементальном обходе проверяем по номеру ревизии
+        if self.incremental and known_links:
+            yield from self.request_revisions(
+                {text: safe_url_string(response.urljoin(href)) for text, href in known_links}
+            )
+
+        if self.extraction_engine == "api":
+            yield from self.request_api_pages(
+                {text: safe_url_string(response.urljoin(href)) for text, href in new_list_of_links}
+            )
+        elif new_list_of_links:
+            for _, movie_link in new_list_of_links:
+                request = self.movie_request("https://ru.wikipedia.org" + movie_link)
+                if self.crawl_state:
+                    self.crawl_state.add_pending(request.url)
+                # В режиме с ограничением памяти ссылки ждут в очереди на диске
+                if self.backpressure:
+                    self.backpressure.push(request.url)
+                else:
+                    yield request
+            if self.backpressure:
+                yield from self.backpressure.requests(self.backpressure.page_requests)
 
         # Пагинация - продолжаем, если есть ссылка с текстом "Следующая страница"
         next_page = response.css("div#mw-pages a::text").getall()
         next_page_links = response.css("div#mw-pages a::attr(href)").getall()
 
+        next_request = None
         for i, link_text in enumerate(next_page):
             if "Следующая страница" in link_text:
-                yield response.follow(next_page_links[i], self.parse)
+                next_request = response.follow(next_page_links[i], self.parse, meta={'frontier': frontier},
+                                               errback=self.download_failed)
                 break
 
-    def parse_movie(self, response):
-        """Собираем данные о фильме."""
-        soup = BeautifulSoup(response.text, "html.parser")
+        # Фронтир заканчивается там, где начинается следующий
+        if next_request and frontier < len(self.shard_boundaries):
+            sortkey, next_title = page_cursor(next_request.url)
+            if reached_boundary(sortkey, self.shard_boundaries[frontier]):
+                self.shard_coverage.stopped(frontier, next_title)
+                next_request = None
 
-        # Инфобокс (таблица с данными о фильме)
-        infobox = soup.find("table", class_="infobox")
+        # Страница обработана: сохраняем курсор следующей страницы и очередь фильмов
+        if self.crawl_state:
+            self.crawl_state.set_cursor(frontier, next_request.url if next_request else None)
+            self.crawl_state.save()
 
-        # Заголовок страницы
-        title_element = soup.find("h1", class_="firstHeading")
+        # Пока фильмы с прошлых страниц не запрошены, следующая страница ждёт
+        if next_request and self.backpressure:
+            next_request = self.backpressure.next_page(next_request)
+        if next_request:
+            yield next_request
 
-        if not title_element:
-            self.logger.warning(f"Ошибка загрузки страницы фильма: {response.url}")
-            yield Request(url=response.url, callback=self.parse_movie, dont_filter=True)
-            return
-
-        title = title_element.text.strip() if title_element else None
+    def movie_request(self, url):
+        return Request(url, callback=self.parse_movie, errback=self.download_failed, priority=MOVIE_PRIORITY)
 
-        original_title = get_original_title(title, infobox)
-
-        # Получаем жанр, страну и режиссёра
-        genre = get_list_from_infobox("Жанр", infobox)
-        country = get_list_from_infobox("Стран", infobox)
-        director = get_list_from_infobox("Режиссёр", infobox)
+    def parse_movie(self, response):
+        """Собираем данные о фильме."""
+        if response.status == 404:
+            # У настоящей 404 Википедии есть заголовок, но нет инфобокса: без этой проверки она
+            # разобралась бы как статья без инфобокса и попала бы в выдачу
+            if not self.page_failed(response, NOT_FOUND):
+                self.movies_lost(response.request)
+            return None
+        if self.parse_pool:
+            # Разбор в пуле процессов: реактор только отправляет тело страницы и получает словарь
+            d = self.parse_pool.submit(
+                extract_movie_from_body, response.body, response.url, response.encoding, self.parser_backend,
+            )
+            d.addCallback(lambda movie: self.handle_movie(response, movie))
+            return d
+        return self.handle_movie(response, extract_movie(response, self.parser_backend))
+
+    def handle_movie(self, response, movie):
+        """Повторяет запрос, если страница битая, иначе запрашивает рейтинг фильма."""
+        if movie is None:
+            if not self.page_failed(response, classify(response)):
+                self.movies_lost(response.request)
+            return
+        # Страница без инфобокса может быть обрезана прокси: перезапрашиваем в пределах бюджета,
+        # дальше считаем, что инфобокса у статьи действительно нет
+        if not movie['has_infobox'] and self.retry_policy.can_retry(response.request, MISSING_INFOBOX):
+            self.page_failed(response, MISSING_INFOBOX)
+            return
 
-        # Год выхода
-        year = next(
-            (get_infobox_value(label, infobox) for label in [
-                "Год", "Дата выхода", "Первый показ", "Дата премьеры",
-            ] if get_infobox_value(label, infobox)),
-            None,
-        )
-        if year:
-            match = re.search(r"\b\d{4}\b", year)
-            year = match.group(0) if match else None
+        if self.crawl_state:
+            # Страница могла быть получена через редирект, в очереди лежит исходный URL
+            self.crawl_state.movie_parsed(response.meta.get('redirect_urls', [response.url])[0], movie['title'])
 
-        # Получаем рейтинг IMDb
-        imdb_link = get_infobox_imdb_link(infobox)
+        yield from self.movie_with_rating(movie['title'], movie['original_title'], movie['genre'], movie['director'],
+                                          movie['country'], movie['year'], movie['imdb_link'], movie['revid'])
 
+    def movie_with_rating(self, title, original_title, genre, director, country, year, imdb_link, revid=None):
+        """Собирает данные о фильме и запрашивает для него рейтинг IMDb."""
         original_title_search = original_title
         russian_title_search = re.sub(r"\s*\(фильм[^)]*\)", "", title)
 
         # Если есть год, то добавляем в поисковый запрос, чтобы не ошибиться с фильмом со схожим названием
         if year:
-            original_title_search = f"{original_title} ({year})"
+            original_title_search = f"{original_title} ({year})" if original_title else None
             russian_title_search = f"{title} ({year})"
 
-        imdb_rating = self.get_imdb_rating(original_title_search, imdb_link)
-        if not imdb_rating:
-            imdb_rating = self.get_imdb_rating(russian_title_search, imdb_link)
-
-        # Данные о фильме
-        movie_data = {
-            'title': title,
-            'original_title': original_title,
-            'genre': ", ".join(genre),
-            'director': ", ".join(director),
-            'country': ", ".join(country),
-            'year': year,
-            'imdb_rating': imdb_rating,
-        }
+        # Данные о фильме, приводятся к типам и проверяются один раз здесь
+        movie = MoviesParserItem(
+            title=title,
+            original_title=original_title,
+            genre=genre,
+            director=director,
+            country=country,
+            year=year,
+            revid=revid,
+        )
 
-        yield movie_data
+        # Без ссылки в инфобоксе фильм сначала ищется в локальном индексе названий IMDb
+        if not imdb_link:
+            imdb_id = self.dataset_imdb_id([original_title, title], movie.year)
+            if imdb_id:
+                imdb_link = f"https://www.imdb.com/title/{imdb_id}/"
+
+        # Если ссылки нет и там, ищем на IMDb сначала по оригинальному названию, затем по русскому
+        # (у статьи без инфобокса оригинального названия нет)
+        searches = [] if imdb_link else [search for search in (original_title_search, russian_title_search) if search]
+        yield from self.request_imdb_rating(movie, searches, imdb_link)
+
+    def request_api_pages(self, urls):
+        """Запрашивает элементы Wikidata для страниц фильмов (название -> URL) пакетами по API_BATCH_SIZE."""
+        for batch in wikidata.chunks(urls.items(), self.api_batch_size):
+            urls = dict(batch)
+            if self.crawl_state:
+                for url in urls.values():
+                    self.crawl_state.add_pending(url)
+            yield FormRequest(
+                url=wikidata.WIKIPEDIA_API,
+                formdata=wikidata.pageprops_query(urls),
+                callback=self.parse_api_pages,
+                errback=self.download_failed,
+                cb_kwargs={'urls': urls},
+                priority=MOVIE_PRIORITY,
+            )
 
-    def get_imdb_rating(self, movie_title, imdb_link=None):
-        """Функция для получения рейтинга IMDb."""
-        search_url = f"https://www.imdb.com/find/?q={movie_title}&s=tt"
-        headers = {"User-Agent": "Mozilla/5.0"}
+    def parse_api_pages(self, response, urls):
+        """Получаем элементы Wikidata; страницы без элемента разбираем из HTML."""
+        try:
+            data = response.json()
+        except ValueError:
+            if not self.page_failed(response, classify(response)):
+                yield from self.request_html_pages(urls.values())
+            return
 
-        if not imdb_link:
-            response = requests.get(search_url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.text, "html.parser")
-            # Получаем ссылку на первый найденный фильм
-            first_result = soup.find("a", {"class": "ipc-metadata-list-summary-item__t"})
+        items, without_item = wikidata.wikibase_items(data, urls)
+        self.crawler.stats.inc_value("wikidata/pages/with_item", len(items))
+        self.crawler.stats.inc_value("wikidata/pages/without_item", len(without_item))
+        yield from self.request_html_pages(urls[title] for title in without_item)
+
+        if items:
+            pages = {qid: (title, urls[source_title], revid) for qid, (title, source_title, revid) in items.items()}
+            yield Request(
+                url=wikidata.entities_url(pages, "claims"),
+                callback=self.parse_wikidata_entities,
+                errback=self.download_failed,
+                cb_kwargs={'pages': pages},
+                priority=MOVIE_PRIORITY,
+            )
+
+    def parse_wikidata_entities(self, response, pages):
+        """Получаем факты о фильмах и запрашиваем подписи для ещё неизвестных жанров, людей и стран."""
+        try:
+            entities = response.json()["entities"]
+        except (ValueError, KeyError):
+            if not self.page_failed(response, classify(response)):
+                yield from self.request_html_pages(url for _, url, _ in pages.values())
+            return
 
-            if first_result:
-                href = "https://www.imdb.com" + first_result["href"]
+        facts = {qid: wikidata.film_facts(entities[qid])
+                 for qid in pages if qid in entities and "missing" not in entities[qid]}
+        yield from self.request_html_pages(url for qid, (_, url, _) in pages.items() if qid not in facts)
+
+        label_ids = sorted({
+            label_id
+            for fact in facts.values()
+            for field in ("genre", "director", "country")
+            for label_id in fact[field]
+            if label_id not in self.wikidata_labels
+        })
+        yield from self.request_wikidata_labels(facts, pages, label_ids)
+
+    def request_wikidata_labels(self, facts, pages, label_ids):
+        """Запрашивает подписи пакетами, после последнего пакета отдаёт фильмы."""
+        if label_ids:
+            batch, label_ids = label_ids[:wikidata.MAX_BATCH_SIZE], label_ids[wikidata.MAX_BATCH_SIZE:]
+            yield Request(
+                url=wikidata.entities_url(batch, "labels"),
+                callback=self.parse_wikidata_labels,
+                errback=self.download_failed,
+                cb_kwargs={'facts': facts, 'pages': pages, 'label_ids': label_ids},
+                priority=MOVIE_PRIORITY,
+            )
+            return
+
+        for qid, fact in facts.items():
+            title, url, revid = pages[qid]
+            if self.crawl_state:
+                self.crawl_state.movie_parsed(url, title)
+            labels = {field: [self.wikidata_labels[label_id] for label_id in fact[field]
+                              if label_id in self.wikidata_labels]
+                      for field in ("genre", "director", "country")}
+            original_title = fact["original_title"] or re.sub(r"\s*\(фильм[^)]*\)", "", title)
+            imdb_link = f"https://www.imdb.com/title/{fact['imdb_id']}/" if fact["imdb_id"] else None
+            yield from self.movie_with_rating(title, original_title, labels["genre"], labels["director"],
+                                              labels["country"], fact["year"], imdb_link, revid)
+
+    def parse_wikidata_labels(self, response, facts, pages, label_ids):
+        """Запоминаем подписи; если повторы исчерпаны, фильмы отдаются с тем, что известно."""
+        try:
+            self.wikidata_labels.update(wikidata.entity_labels(response.json()))
+        except ValueError:
+            if self.page_failed(response, classify(response)):
+                return
+        yield from self.request_wikidata_labels(facts, pages, label_ids)
+
+    def request_html_pages(self, urls):
+        """Обычный разбор статьи, для страниц без данных в Wikidata."""
+        for url in urls:
+            yield Request(url=url, callback=self.parse_movie, errback=self.download_failed, priority=MOVIE_PRIORITY)
+
+    def request_revisions(self, urls):
+        """Запрашивает текущие ревизии уже собранных статей пакетами по 50."""
+        for batch in wikidata.chunks(urls.items(), wikidata.MAX_BATCH_SIZE):
+            urls = dict(batch)
+            yield FormRequest(
+                url=wikidata.WIKIPEDIA_API,
+                formdata=wikidata.revisions_query(urls),
+                callback=self.parse_revisions,
+                errback=self.download_failed,
+                cb_kwargs={'urls': urls},
+                priority=MOVIE_PRIORITY,
+            )
 
-                if "imdb.com/title/" in href:
-                    imdb_link = re.search(r"https://www.imdb.com/title/tt\d+", href)
-                    if imdb_link:
-                        imdb_link = imdb_link.group(0)
+    def parse_revisions(self, response, urls):
+        """Перезапрашиваем изменившиеся статьи и обновляем устаревшие рейтинги остальных."""
+        try:
+            revisions = wikidata.page_revisions(response.json(), urls)
+        except ValueError:
+            self.page_failed(response, classify(response))
+            return
 
-        if not imdb_link:
+        stats = self.crawler.stats
+        changed = {}
+        for title, url in urls.items():
+            revid = revisions.get(title)
+            if revid is None:
+                continue  # Страница удалена или не пришла в ответе
+            stored_revid, imdb_id, rating_at = self.titles_seen.revision(title) or (None, None, None)
+            if stored_revid != revid:
+                changed[title] = url
+                if self.extraction_engine != "api":
+                    if self.crawl_state:
+                        self.crawl_state.add_pending(url)
+                    # Если в HTTP-кэше уже эта ревизия, страница возьмётся оттуда
+                    yield Request(url=url, callback=self.parse_movie, errback=self.download_failed,
+                                  meta={'revid': revid, 'incremental': True}, priority=MOVIE_PRIORITY)
+            elif imdb_id and (rating_at or 0) < time.time() - self.rating_max_age:
+                stats.inc_value("incremental/rating_refresh")
+                rating = self.dataset_rating(imdb_id)
+                if rating:
+                    yield RatingUpdate(title, rating, time.time())
+                    continue
+                yield Request(
+                    url=f"https://www.imdb.com/title/{imdb_id}/",
+                    callback=self.parse_imdb_refresh,
+                    errback=self.download_failed,
+                    cb_kwargs={'title': title},
+                    dont_filter=True,
+                    priority=IMDB_PRIORITY,
+                )
+            else:
+                stats.inc_value("incremental/unchanged")
+
+        stats.inc_value("incremental/changed", len(changed))
+        if changed and self.extraction_engine == "api":
+            yield from self.request_api_pages(changed)
+
+    def request_imdb_rating(self, movie, searches, imdb_link=None):
+        """Запрашивает рейтинг IMDb, фильм отдаётся только после получения рейтинга."""
+        if imdb_link:
+            imdb_id = imdb_id_from_link(imdb_link)
+            movie.imdb_id = normalize_imdb_id(imdb_id)
+            rating = self.dataset_rating(imdb_id)
+            if rating:
+                yield from self.resolve_imdb_rating(movie, searches, rating)
+                return
+            if self.imdb_cache and imdb_id:
+                found, rating = self.imdb_cache.get_rating(imdb_id)
+                if found:
+                    yield from self.resolve_imdb_rating(movie, searches, rating)
+                    return
+
+            yield Request(
+                url=imdb_link,
+                callback=self.parse_imdb_title,
+                errback=self.imdb_failed,
+                cb_kwargs={'movie': movie, 'searches': searches},
+                dont_filter=True,
+                priority=IMDB_PRIORITY,
+            )
+        elif searches:
+            search, searches = searches[0], searches[1:]
+            imdb_id = self.imdb_cache.get_imdb_id(search, movie.year) if self.imdb_cache else None
+            if imdb_id:
+                yield from self.request_imdb_rating(movie, searches, f"https://www.imdb.com/title/{imdb_id}/")
+                return
+
+            query = urllib.parse.urlencode({'q': search, 's': 'tt'})
+            yield Request(
+                url=f"https://www.imdb.com/find/?{query}",
+                callback=self.parse_imdb_search,
+                errback=self.imdb_failed,
+                cb_kwargs={'movie': movie, 'searches': searches, 'search': search},
+                dont_filter=True,
+                priority=IMDB_PRIORITY,
+            )
+        else:
+            yield movie
+
+    def dataset_rating(self, imdb_id):
+        """Рейтинг из локального датасета IMDb без запроса к сайту, или None."""
+        if not (self.imdb_ratings and imdb_id):
             return None
+        found = self.imdb_ratings.get(imdb_id)
+        self.crawler.stats.inc_value("imdb_dataset/hits" if found else "imdb_dataset/misses")
+        return found[0] if found else None
 
-        # Запрашиваем IMDb-страницу
-        imdb_response = requests.get(imdb_link, headers=headers, timeout=10)
-        if imdb_response.status_code != 200:
-            self.logger.warning(f"Failed to fetch IMDb page {imdb_link}: {imdb_response.status_code}")
+    def dataset_imdb_id(self, titles, year):
+        """tt-ID из локального индекса названий IMDb, если совпадение достаточно уверенное, иначе None."""
+        if self.imdb_titles is None:
+            return None
+        stats = self.crawler.stats
+        found = self.imdb_titles.match([title for title in titles if title], year, self.imdb_match_min_confidence)
+        if found is None:
+            stats.inc_value("imdb_titles/not_found")
             return None
+        imdb_id, confidence = found
+        if confidence < self.imdb_match_min_confidence:
+            stats.inc_value("imdb_titles/uncertain")
+            return None
+        stats.inc_value("imdb_titles/matched")
+        return imdb_id
+
+    def resolve_imdb_rating(self, movie, searches, rating):
+        """Отдаёт фильм с рейтингом или переходит к следующему поиску."""
+        if rating:
+            # Повтор запроса IMDb из dead-letter: фильм уже сохранён без рейтинга, дописываем только рейтинг
+            if self.replay and self.titles_seen.stored(movie.title):
+                yield RatingUpdate(movie.title, rating, time.time())
+                return
+            movie.imdb_rating = normalize_rating(rating)
+            movie.rating_updated_at = time.time()
+            yield movie
+        else:
+            yield from self.request_imdb_rating(movie, searches)
 
-        imdb_soup = BeautifulSoup(imdb_response.text, "html.parser")
+    def parse_imdb_search(self, response, movie, searches, search):
+        """Получаем ссылку на первый найденный фильм."""
+        if not response.css("#home_img_holder"):
+            if not self.page_failed(response, classify(response)):
+                yield from self.request_imdb_rating(movie, searches)
+            return
 
-        # Проверяем, действительно ли мы на IMDb (поиск логотипа IMDb)
-        if not imdb_soup.find("a", {"id": "home_img_holder"}):
-            self.logger.warning(f"Ошибка загрузки страницы IMDb: {imdb_link}")
-            return self.get_imdb_rating(movie_title)  # Повторный запрос
+        imdb_link = None
+        first_result = response.css("a.ipc-metadata-list-summary-item__t::attr(href)").get()
+        if first_result:
+            match = re.search(r"https://www.imdb.com/title/tt\d+", "https://www.imdb.com" + first_result)
+            if match:
+                imdb_link = match.group(0)
+                if self.imdb_cache:
+                    self.imdb_cache.set_imdb_id(search, movie.year, imdb_id_from_link(imdb_link))
 
-        # Извлекаем рейтинг
-        rating_element = imdb_soup.find("div", {"data-testid": "hero-rating-bar__aggregate-rating__score"})
-        if rating_element:
-            return rating_element.text.strip().split("/")[0]  # Оставляем только число рейтинга
+        yield from self.request_imdb_rating(movie, searches, imdb_link)
 
-        return None
+    def parse_imdb_title(self, response, movie, searches):
+        """Функция для получения рейтинга IMDb."""
+        is_imdb_page, rating = get_imdb_rating(response)
+        if not is_imdb_page:
+            # Повторы исчерпаны: переходим к следующему поиску или сохраняем фильм без рейтинга
+            if not self.page_failed(response, classify(response)):
+                yield from self.resolve_imdb_rating(movie, searches, None)
+            return
+
+        imdb_id = imdb_id_from_link(response.url)
+        if self.imdb_cache and imdb_id:
+            self.imdb_cache.set_rating(imdb_id, rating)
+
+        yield from self.resolve_imdb_rating(movie, searches, rating)
+
+    def parse_imdb_refresh(self, response, title):
+        """Обновляем только рейтинг уже сохранённого фильма, остальные поля строки не меняются."""
+        is_imdb_page, rating = get_imdb_rating(response)
+        if not is_imdb_page:
+            self.page_failed(response, classify(response))
+            return
+
+        imdb_id = imdb_id_from_link(response.url)
+        if self.imdb_cache and imdb_id:
+            self.imdb_cache.set_rating(imdb_id, rating)
+        if rating:
+            yield RatingUpdate(title, rating, time.time())
+
+    def imdb_failed(self, failure):
+        """Если IMDb недоступен, переходим к следующему поиску."""
+        request = failure.request
+        self.logger.warning(f"Failed to fetch IMDb page {request.url}: {failure.value!r}")
+        yield from self.request_imdb_rating(request.cb_kwargs['movie'], request.cb_kwargs['searches'])
+
+    def page_failed(self, response, failure_class):
+        """Повторяет запрос по политике повторов; возвращает False, если повторы исчерпаны."""
+        self.logger.warning(f"Ошибка загрузки ({failure_class}): {response.url}")
+        return self.retry_policy.retry(response.request, failure_class, self)
+
+    def download_failed(self, failure):
+        """Страница Википедии не загрузилась и после повторов RetryMiddleware."""
+        self.logger.warning(f"Failed to fetch {failure.request.url}: {failure.value!r}")
+        if not self.retry_policy.retry(failure.request, DOWNLOAD_ERROR, self):
+            self.movies_lost(failure.request)
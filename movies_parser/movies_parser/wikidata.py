@@ -0,0 +1,146 @@
+# MediaWiki / Wikidata API extraction engine
+#
+# Instead of downloading every article, titles from the category listing are
+# resolved in batches: MediaWiki `prop=pageprops` gives the Wikidata item of
+# each page, `wbgetentities` gives its claims (genre, director, country,
+# publication date, IMDb ID, original title), and the referenced genres,
+# people and countries are turned into Russian labels with one more
+# `wbgetentities` call per batch of unknown IDs. The MediaWiki `prop=info`
+# query also gives the current revision ids used by the incremental recrawl.
+import urllib.parse
+
+WIKIPEDIA_API = "https://ru.wikipedia.org/w/api.php"
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+
+# Ограничение MediaWiki на число названий / идентификаторов в одном запросе
+MAX_BATCH_SIZE = 50
+
+GENRE = "P136"
+DIRECTOR = "P57"
+COUNTRY = "P495"
+PUBLICATION_DATE = "P577"
+IMDB_ID = "P345"
+TITLE = "P1476"
+
+LABEL_LANGUAGES = ("ru", "en")
+
+
+def chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def pageprops_query(titles):
+    """Параметры POST-запроса wikibase_item (и текущей ревизии) для списка страниц."""
+    return {
+        "action": "query",
+        "format": "json",
+        "formatversion": "2",
+        "prop": "pageprops|info",
+        "ppprop": "wikibase_item",
+        "redirects": "1",
+        "titles": "|".join(titles),
+    }
+
+
+def revisions_query(titles):
+    """Параметры POST-запроса текущих ревизий (lastrevid) для списка страниц."""
+    return {
+        "action": "query",
+        "format": "json",
+        "formatversion": "2",
+        "prop": "info",
+        "redirects": "1",
+        "titles": "|".join(titles),
+    }
+
+
+def entities_url(ids, props):
+    query = urllib.parse.urlencode({
+        "action": "wbgetentities",
+        "format": "json",
+        "ids": "|".join(ids),
+        # info - lastrevid элементов: без номера ревизии ответ не попадёт в HTTP-кэш
+        "props": f"{props}|info",
+        "languages": "|".join(LABEL_LANGUAGES),
+    })
+    return f"{WIKIDATA_API}?{query}"
+
+
+def resolve_pages(data, titles):
+    """Сопоставляет запрошенные названия страницам из ответа query с учётом нормализации и перенаправлений.
+
+    Возвращает {исходное название: страница}; страницы, не пришедшие в ответе, - пустые словари.
+    """
+    query = data.get("query", {})
+    renames = {entry["from"]: entry["to"] for entry in query.get("normalized", [])}
+    redirects = {entry["from"]: entry["to"] for entry in query.get("redirects", [])}
+    pages = {page["title"]: page for page in query.get("pages", [])}
+
+    resolved = {}
+    for title in titles:
+        target = renames.get(title, title)
+        resolved[title] = pages.get(redirects.get(target, target), {})
+    return resolved
+
+
+def wikibase_items(data, titles):
+    """Сопоставляет запрошенные названия элементам Wikidata.
+
+    Возвращает {QID: (название страницы, исходное название, revid)} и список
+    исходных названий, для которых элемента нет (или страница не пришла в ответе).
+    """
+    items = {}
+    without_item = []
+    for title, page in resolve_pages(data, titles).items():
+        qid = page.get("pageprops", {}).get("wikibase_item")
+        if qid:
+            items[qid] = (page["title"], title, page.get("lastrevid"))
+        else:
+            without_item.append(title)
+    return items, without_item
+
+
+def page_revisions(data, titles):
+    """Текущие ревизии страниц: {исходное название: lastrevid}, удалённые страницы пропускаются."""
+    return {title: page["lastrevid"] for title, page in resolve_pages(data, titles).items() if "lastrevid" in page}
+
+
+def claim_values(entity, prop):
+    """Значения утверждения, кроме устаревших (deprecated) и без значения."""
+    values = []
+    for claim in entity.get("claims", {}).get(prop, []):
+        snak = claim.get("mainsnak", {})
+        if claim.get("rank") == "deprecated" or snak.get("snaktype") != "value":
+            continue
+        values.append(snak["datavalue"]["value"])
+    return values
+
+
+def film_facts(entity):
+    """Факты о фильме из элемента Wikidata; жанры, режиссёры и страны - списки QID."""
+    years = [int(value["time"][1:5]) for value in claim_values(entity, PUBLICATION_DATE)
+             if value.get("time", "")[1:5].isdigit()]
+    imdb_ids = [value for value in claim_values(entity, IMDB_ID) if value.startswith("tt")]
+    titles = [value["text"] for value in claim_values(entity, TITLE)]
+    return {
+        "genre": [value["id"] for value in claim_values(entity, GENRE)],
+        "director": [value["id"] for value in claim_values(entity, DIRECTOR)],
+        "country": [value["id"] for value in claim_values(entity, COUNTRY)],
+        "year": str(min(years)) if years else None,
+        "imdb_id": imdb_ids[0] if imdb_ids else None,
+        "original_title": titles[0] if titles else None,
+    }
+
+
+def entity_labels(data):
+    """Подписи элементов: русская, если есть, иначе английская."""
+    labels = {}
+    for qid, entity in data.get("entities", {}).items():
+        entity_labels = entity.get("labels", {})
+        for language in LABEL_LANGUAGES:
+            if language in entity_labels:
+                labels[qid] = entity_labels[language]["value"]
+                break
+    return labels
@@ -0,0 +1,314 @@
+# Output writers used by MoviesParserPipeline
+#
+# Items are written in batches. CSV and JSON lines are appended with one
+# write + fsync per batch, and a torn last line left by a crash is cut off on
+# the next open. Parquet batches become separate part files with typed columns,
+# written to a temporary name and renamed into place. Updates of existing rows
+# (incremental recrawl) are merged in by rewriting the output once per run.
+# Outputs of several nodes of a distributed crawl are combined by merge_outputs.
+import codecs
+import csv
+import io
+import json
+import os
+import time
+from pathlib import Path
+
+from itemadapter import ItemAdapter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow нужен только для OUTPUT_FORMAT = "parquet"
+    pa = pq = None
+
+FIELDS = ["title", "original_title", "genre", "director", "country", "year", "imdb_rating"]
+LIST_FIELDS = ("genre", "director", "country")
+
+DEFAULT_PATHS = {
+    "csv": "movies.csv",
+    "jsonl": "movies.jsonl",
+    "parquet": "movies.parquet",
+}
+
+
+def typed_row(item):
+    """Приводит поля фильма к типам: год - int, рейтинг - float, жанры/режиссёры/страны - списки."""
+    adapter = ItemAdapter(item)
+    row = {field: adapter.get(field) for field in FIELDS}
+    for field in LIST_FIELDS:
+        value = row[field]
+        if isinstance(value, str):
+            row[field] = [s.strip() for s in value.split(",") if s.strip()]
+        else:
+            row[field] = list(value or [])
+    row["year"] = int(row["year"]) if row["year"] else None
+    row["imdb_rating"] = float(row["imdb_rating"]) if row["imdb_rating"] else None
+    return row
+
+
+def csv_value(value):
+    """Значение поля для CSV: жанры, режиссёры и страны - через запятую, None - пустая ячейка."""
+    return ", ".join(value) if isinstance(value, (list, tuple)) else value
+
+
+def item_row(row):
+    """Обратное typed_row: строка любого формата в виде item паука (списки через запятую, год - строка)."""
+    item = {field: row.get(field) for field in FIELDS}
+    for field in LIST_FIELDS:
+        if isinstance(item[field], list):
+            item[field] = ", ".join(item[field])
+    if isinstance(item["year"], int):
+        item["year"] = str(item["year"])
+    if isinstance(item["imdb_rating"], float):
+        # float32 из Parquet: 7.3 читается как 7.300000190734863
+        item["imdb_rating"] = round(item["imdb_rating"], 1)
+    return item
+
+
+def merge_row(row, update, typed=False):
+    """Накладывает обновление на строку; обновление может содержать только часть полей.
+
+    Пустые поля не затирают сохранённые: статья перезапрашивается после правки, и рейтинг,
+    не найденный на IMDb в этот раз, остаётся прежним.
+    """
+    values = {field: value for field, value in (typed_row(update) if typed else update).items()
+              if field in update and field in FIELDS and value not in (None, "", [], ())}
+    return {**row, **values}
+
+
+def is_full(update):
+    """Обновление содержит все поля и может быть добавлено как новая строка."""
+    return all(field in update for field in FIELDS)
+
+
+def csv_encoding(path):
+    """Кодировка существующего файла: прежняя версия паука писала movies.csv в utf-8-sig (с BOM)."""
+    with Path(path).open("rb") as f:
+        return "utf-8-sig" if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else "utf-8"
+
+
+def repair_tail(path):
+    """Обрезает недописанную последнюю строку, оставшуюся после аварийного завершения."""
+    with Path(path).open("rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Ищем конец последней полной строки с конца файла
+        position = size
+        while position > 0:
+            step = min(64 * 1024, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+class AppendWriter:
+    """Базовый класс для построчных форматов: одна запись и fsync на пакет."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.exists():
+            repair_tail(self.path)
+        self.file = self.path.open("a", newline="", encoding="utf-8")  # noqa: SIM115
+        if self.file.tell() == 0:
+            self.write_header()
+
+    def write_header(self):
+        pass
+
+    def serialize(self, items, buffer):
+        raise NotImplementedError
+
+    def write_batch(self, items):
+        buffer = io.StringIO()
+        self.serialize(items, buffer)
+        self.file.write(buffer.getvalue())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def merge(self, source, target, updates):
+        raise NotImplementedError
+
+    def upsert(self, updates):
+        """Обновляет строки по названию, переписывая файл через временный; новые названия дописываются."""
+        updates = dict(updates)
+        self.file.close()
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        # BOM не должен попасть в имя первой колонки и сохраняется в переписанном файле
+        encoding = csv_encoding(self.path)
+        with self.path.open(newline="", encoding=encoding) as source, \
+                tmp_path.open("w", newline="", encoding=encoding) as target:
+            self.merge(source, target, updates)
+            self.serialize([update for update in updates.values() if is_full(update)], target)
+            target.flush()
+            os.fsync(target.fileno())
+        tmp_path.replace(self.path)
+        self.file = self.path.open("a", newline="", encoding="utf-8")  # noqa: SIM115
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter(AppendWriter):
+    def write_header(self):
+        csv.writer(self.file).writerow(FIELDS)
+        self.file.flush()
+
+    def serialize(self, items, buffer):
+        writer = csv.writer(buffer)
+        for item in items:
+            adapter = ItemAdapter(item)
+            writer.writerow([csv_value(adapter.get(field)) for field in FIELDS])
+
+    def merge(self, source, target, updates):
+        reader = csv.DictReader(source)
+        writer = csv.DictWriter(target, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        for row in reader:
+            update = updates.pop(row["title"], None)
+            if update:
+                row = merge_row(row, {field: csv_value(value) for field, value in update.items()})
+            writer.writerow(row)
+
+
+class JsonLinesWriter(AppendWriter):
+    def serialize(self, items, buffer):
+        for item in items:
+            buffer.write(json.dumps(typed_row(item), ensure_ascii=False))
+            buffer.write("\n")
+
+    def merge(self, source, target, updates):
+        for line in source:
+            update = updates.pop(json.loads(line)["title"], None) if updates else None
+            if update:
+                line = json.dumps(merge_row(json.loads(line), update, typed=True), ensure_ascii=False) + "\n"
+            target.write(line)
+
+
+class ParquetWriter:
+    """Каталог part-файлов Parquet, по одному на пакет."""
+
+    def __init__(self, path, row_group_size=10_000):
+        if pa is None:
+            raise ImportError("Для OUTPUT_FORMAT = 'parquet' установите pyarrow: pip install pyarrow")
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.row_group_size = row_group_size
+        self.parts = 0
+        self.schema = pa.schema([
+            ("title", pa.string()),
+            ("original_title", pa.string()),
+            ("genre", pa.list_(pa.string())),
+            ("director", pa.list_(pa.string())),
+            ("country", pa.list_(pa.string())),
+            ("year", pa.int32()),
+            ("imdb_rating", pa.float32()),
+        ])
+
+    def write_batch(self, items):
+        self.parts += 1
+        name = f"part-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self.parts:05d}.parquet"
+        self.write_part(self.path / name, [typed_row(item) for item in items])
+
+    def write_part(self, path, rows):
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_size)
+        tmp_path.replace(path)
+
+    def upsert(self, updates):
+        """Переписывает только part-файлы, в которых есть обновляемые названия; новые идут отдельным файлом."""
+        updates = dict(updates)
+        for part in sorted(self.path.glob("part-*.parquet")):
+            titles = pq.read_table(part, columns=["title"]).column("title").to_pylist()
+            if not updates.keys() & set(titles):
+                continue
+            rows = pq.read_table(part, schema=self.schema).to_pylist()
+            rows = [merge_row(row, updates.pop(row["title"]), typed=True) if row["title"] in updates else row
+                    for row in rows]
+            self.write_part(part, rows)
+        new_rows = [update for update in updates.values() if is_full(update)]
+        if new_rows:
+            self.write_batch(new_rows)
+
+    def close(self):
+        pass
+
+
+def output_format_of(path):
+    """Формат результатов по пути: каталог или .parquet - parquet, .jsonl - jsonl, иначе csv."""
+    path = Path(path)
+    if path.is_dir() or path.suffix == ".parquet":
+        return "parquet"
+    return "jsonl" if path.suffix == ".jsonl" else "csv"
+
+
+def read_rows(path):
+    """Строки файла результатов в виде item паука."""
+    output_format = output_format_of(path)
+    if output_format == "parquet":
+        if pq is None:
+            raise ImportError("Для чтения Parquet установите pyarrow: pip install pyarrow")
+        for part in sorted(Path(path).glob("part-*.parquet")):
+            yield from (item_row(row) for row in pq.read_table(part).to_pylist())
+        return
+    with Path(path).open(newline="", encoding="utf-8-sig") as f:
+        rows = (json.loads(line) for line in f) if output_format == "jsonl" else csv.DictReader(f)
+        yield from (item_row(row) for row in rows)
+
+
+def merge_outputs(sources, target, batch_size=10_000):
+    """Объединяет результаты нескольких узлов в новый файл target без повторов названий.
+
+    Остаётся первая строка с названием, её пустые поля (например, рейтинг, который
+    не удалось получить на одном из узлов) дополняются из следующих. Формат каждого
+    файла определяется по пути. Возвращает число записанных фильмов.
+    """
+    if Path(target).exists():
+        raise FileExistsError(f"{target} уже существует")
+    rows = {}
+    for source in sources:
+        for row in read_rows(source):
+            known = rows.setdefault(row["title"], row)
+            for field, value in row.items():
+                if known[field] in (None, "") and value not in (None, ""):
+                    known[field] = value
+
+    writer = WRITERS[output_format_of(target)](target)
+    items = list(rows.values())
+    for start in range(0, len(items), batch_size):
+        writer.write_batch(items[start:start + batch_size])
+    writer.close()
+    return len(items)
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def output_path(settings):
+    """Путь к файлу (или каталогу для Parquet) с результатами."""
+    return settings.get("OUTPUT_PATH") or DEFAULT_PATHS[settings.get("OUTPUT_FORMAT", "csv")]
+
+
+def open_writer(settings):
+    output_format = settings.get("OUTPUT_FORMAT", "csv")
+    path = output_path(settings)
+    if output_format == "parquet":
+        return ParquetWriter(path, settings.getint("OUTPUT_PARQUET_ROW_GROUP_SIZE", 10_000))
+    if output_format in WRITERS:
+        return WRITERS[output_format](path)
+    raise ValueError(f"Неизвестный OUTPUT_FORMAT: {output_format!r}")
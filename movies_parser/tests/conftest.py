@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import pytest
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from movies_parser.spiders.movies import MoviesSpider
+
+FIXTURES_DIR = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures"
+
+
+def fixture_response(name, url, **request_kwargs):
+    """Ответ с записанной страницей из benchmarks/fixtures."""
+    request = Request(url, **request_kwargs)
+    return HtmlResponse(url=url, body=(FIXTURES_DIR / name).read_bytes(), encoding="utf-8", request=request)
+
+
+@pytest.fixture
+def make_spider(tmp_path):
+    """Паук без сети и без файлов вне tmp_path; настройки можно переопределить."""
+
+    def make(spidercls=MoviesSpider, **settings):
+        crawler = get_crawler(spidercls, {
+            "IMDB_CACHE_ENABLED": False,
+            "IMDB_CACHE_PATH": str(tmp_path / "imdb_cache.sqlite"),
+            "CRAWL_STATE_FILE": None,
+            "SEEN_TITLES_PATH": ":memory:",
+            "OUTPUT_PATH": str(tmp_path / "movies.csv"),
+            "RETRY_DEAD_LETTER_FILE": None,
+            **settings,
+        })
+        spider = spidercls.from_crawler(crawler)
+        crawler.stats.open_spider(spider)
+        spider.spider_opened()
+        return spider
+
+    return make
@@ -0,0 +1,43 @@
+import pytest
+
+from movies_parser.category_shards import SHARD_ALPHABET
+from movies_parser.category_shards import SHARD_WEIGHTS
+from movies_parser.category_shards import check_boundaries
+from movies_parser.category_shards import shard_boundaries
+
+
+def shard_shares(boundaries):
+    """Доля ожидаемых названий в каждом фронтире."""
+    starts = [0] + [SHARD_ALPHABET.index(boundary) for boundary in boundaries] + [len(SHARD_ALPHABET)]
+    total = sum(SHARD_WEIGHTS.values())
+    return [sum(SHARD_WEIGHTS[char] for char in SHARD_ALPHABET[a:b]) / total for a, b in zip(starts, starts[1:])]
+
+
+@pytest.mark.parametrize("count", [2, 4, 8])
+def test_boundaries_split_titles_evenly(count):
+    boundaries = shard_boundaries(count)
+
+    assert len(boundaries) == count - 1
+    # Кириллическая категория делится между всеми фронтирами, а не падает в один-два
+    assert max(shard_shares(boundaries)) < 2 / count
+
+
+def test_boundary_per_character():
+    assert shard_boundaries(len(SHARD_ALPHABET)) == list(SHARD_ALPHABET[1:])
+    assert shard_boundaries(1000) == list(SHARD_ALPHABET[1:])
+    assert shard_boundaries(1) == []
+
+
+def test_explicit_boundaries_checked():
+    assert check_boundaries(["К", "П", "С"]) == ["К", "П", "С"]
+    with pytest.raises(ValueError):
+        check_boundaries(["П", "К"])
+    with pytest.raises(ValueError):
+        check_boundaries(["По"])
+
+
+def test_spider_uses_explicit_boundaries(make_spider):
+    spider = make_spider(CATEGORY_SHARDS=8, CATEGORY_SHARD_BOUNDARIES=["К", "П", "С"])
+
+    assert spider.shard_boundaries == ["К", "П", "С"]
+    assert [request.meta["frontier"] for request in spider.start_requests()] == [0, 1, 2, 3]
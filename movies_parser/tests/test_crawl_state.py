@@ -0,0 +1,99 @@
+import json
+
+from scrapy import signals
+from scrapy.http import Request
+from twisted.internet.error import ConnectionRefusedError
+from twisted.python.failure import Failure
+
+from movies_parser.crawl_state import CrawlState
+from tests.conftest import fixture_response
+
+MOVIE_URL = "https://ru.wikipedia.org/wiki/Сталкер_(фильм)"
+
+
+def write_state(path, cursors, pending):
+    path.write_text(json.dumps({"cursors": cursors, "pending": pending}), encoding="utf-8")
+
+
+def test_finished_crawl_removes_state_with_pending(tmp_path):
+    path = tmp_path / "crawl_state.json"
+    write_state(path, {"0": None}, [MOVIE_URL])
+    state = CrawlState(path)
+
+    assert state.resumable()
+    state.close("finished")
+    assert not path.exists()
+
+
+def test_pending_movies_resume_after_last_page(make_spider, tmp_path):
+    path = tmp_path / "crawl_state.json"
+    movie_url = Request(MOVIE_URL).url
+    write_state(path, {"0": None}, [movie_url])
+    spider = make_spider(CRAWL_STATE_FILE=str(path))
+
+    requests = list(spider.start_requests())
+
+    # Категория пройдена: запрашиваются только фильмы из очереди, с начала она не обходится
+    assert [request.url for request in requests] == [movie_url]
+    assert requests[0].callback == spider.parse_movie
+    assert requests[0].errback == spider.download_failed
+    assert list(spider.crawl_state.pending) == [movie_url]
+
+
+def test_empty_state_restarts_from_start_urls(make_spider, tmp_path):
+    path = tmp_path / "crawl_state.json"
+    write_state(path, {"0": None}, [])
+    spider = make_spider(CRAWL_STATE_FILE=str(path))
+
+    requests = list(spider.start_requests())
+
+    assert [request.url for request in requests] == [Request(spider.start_urls[0]).url]
+
+
+def test_dead_lettered_movie_leaves_pending(make_spider, tmp_path):
+    spider = make_spider(CRAWL_STATE_FILE=str(tmp_path / "crawl_state.json"),
+                         RETRY_POLICY_BUDGETS={"download_error": 0})
+    request = spider.movie_request(MOVIE_URL)
+    spider.crawl_state.add_pending(request.url)
+    failure = Failure(ConnectionRefusedError())
+    failure.request = request
+
+    spider.download_failed(failure)
+
+    assert spider.crawl_state.pending == {}
+
+
+def test_callback_error_leaves_pending(make_spider, tmp_path):
+    spider = make_spider(CRAWL_STATE_FILE=str(tmp_path / "crawl_state.json"))
+    response = fixture_response("movie_full.html", MOVIE_URL)
+    spider.crawl_state.add_pending(response.request.url)
+    other = Request("https://ru.wikipedia.org/wiki/Солярис_(фильм)").url
+    spider.crawl_state.add_pending(other)
+
+    spider.crawler.signals.send_catch_log(
+        signals.spider_error, failure=Failure(ValueError()), response=response, spider=spider)
+
+    assert list(spider.crawl_state.pending) == [other]
+
+
+def test_fresh_sharded_crawl_saves_every_cursor(make_spider, tmp_path):
+    path = tmp_path / "crawl_state.json"
+    spider = make_spider(CRAWL_STATE_FILE=str(path), CATEGORY_SHARDS=4)
+
+    requests = list(spider.start_requests())
+
+    cursors = json.loads(path.read_text(encoding="utf-8"))["cursors"]
+    assert sorted(cursors) == ["0", "1", "2", "3"]
+    assert [request.meta["frontier"] for request in requests] == [0, 1, 2, 3]
+
+
+def test_sharded_resume_reseeds_missing_frontiers(make_spider, tmp_path):
+    path = tmp_path / "crawl_state.json"
+    cursor = "https://ru.wikipedia.org/w/index.php?title=Категория:Фильмы_по_алфавиту&pagefrom=Б"
+    write_state(path, {"0": cursor}, [])
+    spider = make_spider(CRAWL_STATE_FILE=str(path), CATEGORY_SHARDS=4)
+
+    requests = list(spider.start_requests())
+
+    assert [request.meta["frontier"] for request in requests] == [0, 1, 2, 3]
+    assert requests[0].url == Request(cursor).url
@@ -0,0 +1,122 @@
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.test import get_crawler
+
+from movies_parser.frontier import FrontierDownloaderMiddleware
+from movies_parser.frontier import RedisFrontier
+from movies_parser.frontier import FrontierSpiderMiddleware
+from movies_parser.frontier import SharedScheduler
+from movies_parser.frontier import SqliteFrontier
+from movies_parser.frontier import shared_scheduler_enabled
+from movies_parser.spiders.movies import MoviesSpider
+
+
+@pytest.mark.parametrize("middleware_cls", [FrontierSpiderMiddleware, FrontierDownloaderMiddleware])
+def test_default_scheduler_leaves_middlewares_disabled(tmp_path, middleware_cls):
+    frontier_path = tmp_path / "frontier.sqlite"
+    crawler = get_crawler(MoviesSpider, {"FRONTIER_URL": str(frontier_path)})
+
+    assert not shared_scheduler_enabled(crawler.settings)
+    with pytest.raises(NotConfigured):
+        middleware_cls.from_crawler(crawler)
+    assert not frontier_path.exists()
+
+
+def test_shared_scheduler_enables_middlewares(tmp_path):
+    frontier_path = tmp_path / "frontier.sqlite"
+    crawler = get_crawler(MoviesSpider, {
+        "SCHEDULER": "movies_parser.frontier.SharedScheduler",
+        "FRONTIER_URL": str(frontier_path),
+    })
+
+    middleware = FrontierSpiderMiddleware.from_crawler(crawler)
+    middleware.spider_closed(None)
+    assert frontier_path.exists()
+
+
+def test_refetch_resets_done_request(make_spider, tmp_path):
+    spider = make_spider(SCHEDULER="movies_parser.frontier.SharedScheduler",
+                         FRONTIER_URL=str(tmp_path / "frontier.sqlite"))
+    scheduler = SharedScheduler.from_crawler(spider.crawler)
+    scheduler.open(spider)
+    stats = spider.crawler.stats
+    url = "https://ru.wikipedia.org/wiki/Сталкер_(фильм)"
+
+    assert scheduler.enqueue_request(spider.movie_request(url))
+    fingerprint, claims = scheduler.next_request().meta["frontier_lease"]
+    assert scheduler.frontier.ack(fingerprint, scheduler.node, claims)
+
+    # Обычный повтор отсеивается, перезапрос изменившейся статьи возвращает запись в очередь
+    assert not scheduler.enqueue_request(spider.movie_request(url))
+    refetch = spider.movie_request(url).replace(meta={"incremental": True})
+    assert scheduler.enqueue_request(refetch)
+    assert stats.get_value("frontier/reset") == 1
+    # Запись уже в очереди: повтор из dead-letter её не трогает
+    assert not scheduler.enqueue_request(spider.movie_request(url).replace(dont_filter=True))
+    assert stats.get_value("frontier/reset_skipped") == 1
+    assert stats.get_value("frontier/duplicates") == 2
+
+    assert scheduler.next_request().meta["incremental"]
+    assert scheduler.next_request() is None
+    scheduler.close("finished")
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_frontier(request, tmp_path):
+    """Фронтир на SQLite или на fakeredis вместо сервера Redis (без fakeredis тесты Redis пропускаются)."""
+
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SqliteFrontier(str(tmp_path / "frontier.sqlite"), **kwargs)
+        fakeredis = pytest.importorskip("fakeredis")
+        return RedisFrontier(fakeredis.FakeRedis(server=fakeredis.FakeServer()), **kwargs)
+
+    return make
+
+
+def test_frontier_claim_and_ack(make_frontier):
+    frontier = make_frontier()
+
+    assert frontier.push(b"low", b"request-low", 1)
+    assert frontier.push(b"high", b"request-high", 5)
+    assert not frontier.push(b"low", b"request-low", 1)
+
+    assert frontier.claim("node-1") == ((b"high", b"request-high", 1), 0, 0)
+    assert frontier.claim("node-2") == ((b"low", b"request-low", 1), 0, 0)
+    assert frontier.claim("node-1") == (None, 0, 0)
+    # Аренду завершает только её владелец
+    assert not frontier.ack(b"high", "node-2", 1)
+    assert frontier.ack(b"high", "node-1", 1)
+    assert frontier.ack(b"low", "node-2", 1)
+    assert not frontier.pending()
+    frontier.close()
+
+
+def test_frontier_expired_lease(make_frontier):
+    # Аренда истекает сразу: запрос достаётся следующему узлу, после max_claims аренд он брошен
+    frontier = make_frontier(lease_seconds=-1, max_claims=2)
+    frontier.push(b"page", b"request", 0)
+
+    assert frontier.claim("node-1") == ((b"page", b"request", 1), 0, 0)
+    assert frontier.claim("node-2") == ((b"page", b"request", 2), 1, 0)
+    assert not frontier.ack(b"page", "node-1", 1)
+    assert frontier.claim("node-3") == (None, 0, 1)
+    assert not frontier.pending()
+    frontier.close()
+
+
+def test_frontier_requeue_and_reset(make_frontier):
+    frontier = make_frontier()
+    frontier.push(b"page", b"request", 0)
+
+    # Повтор арендованного запроса возвращает его в очередь с новым содержимым
+    frontier.claim("node-1")
+    frontier.requeue(b"page", b"retry", 0)
+    assert frontier.claim("node-1")[0] == (b"page", b"retry", 1)
+    # Запись в аренде не сбрасывается, завершённая - возвращается в очередь
+    assert not frontier.reset(b"page", b"replay", 0)
+    assert frontier.ack(b"page", "node-1", 1)
+    assert frontier.reset(b"page", b"replay", 0)
+    assert not frontier.reset(b"page", b"replay", 0)
+    assert frontier.claim("node-2")[0] == (b"page", b"replay", 1)
+    frontier.close()
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from scrapy.http import TextResponse
+from scrapy.settings import Settings
+
+from movies_parser import wikidata
+from movies_parser.httpcache import SqliteCacheStorage
+from movies_parser.httpcache import WikipediaCachePolicy
+from tests.conftest import fixture_response
+
+API_PAGES = {"batchcomplete": True, "query": {"pages": [
+    {"pageid": 1, "ns": 0, "title": "Сталкер (фильм)", "lastrevid": 120, "pageprops": {"wikibase_item": "Q1"}},
+    {"pageid": 2, "ns": 0, "title": "Солярис (фильм)", "lastrevid": 135, "pageprops": {"wikibase_item": "Q2"}},
+]}}
+
+
+def api_response(data, url=wikidata.WIKIPEDIA_API, **request_kwargs):
+    request = Request(url, method="POST", body="titles=x", **request_kwargs)
+    return TextResponse(url=url, body=json.dumps(data).encode(), encoding="utf-8", request=request,
+                        headers={"Cache-Control": "private, must-revalidate, max-age=0"})
+
+
+@pytest.mark.parametrize("data", [
+    API_PAGES,
+    {"query": {"pages": {"1": {"title": "Сталкер (фильм)", "revisions": [{"revid": 120}]}}}},
+    {"continue": {"rvcontinue": "120", "continue": "||"}, "query": {"pages": []}},
+    {"entities": {"Q1": {"type": "item", "id": "Q1", "lastrevid": 7, "labels": {}}}},
+])
+def test_api_responses_are_cached(data):
+    policy = WikipediaCachePolicy(Settings())
+    response = api_response(data)
+
+    assert policy.should_cache_response(response, response.request)
+
+
+def test_api_errors_and_proxy_garbage_are_not_cached():
+    policy = WikipediaCachePolicy(Settings())
+    error = api_response({"error": {"code": "ratelimited"}})
+    garbage = fixture_response("proxy_error.html", wikidata.WIKIPEDIA_API)
+
+    assert not policy.should_cache_response(error, error.request)
+    assert not policy.should_cache_response(garbage, garbage.request)
+
+
+def test_api_response_stored_with_revid(make_spider, tmp_path):
+    spider = make_spider()
+    storage = SqliteCacheStorage(Settings({"HTTPCACHE_DIR": str(tmp_path)}))
+    storage.open_spider(spider)
+    response = api_response(API_PAGES)
+
+    storage.store_response(spider, response.request, response)
+    cached = storage.retrieve_response(spider, response.request)
+
+    # Пакет страниц хранится с последней из их ревизий
+    assert storage.db.execute("SELECT revid FROM responses").fetchone()[0] == 135
+    assert json.loads(cached.body) == API_PAGES
+    storage.close_spider(spider)
+
+    # Известная ревизия берётся из кэша без обращения к сети, как у HTML-страниц
+    policy = WikipediaCachePolicy(Settings())
+    assert policy.is_cached_response_fresh(cached, Request(wikidata.WIKIPEDIA_API, meta={"revid": 135}))
+    assert not policy.is_cached_response_fresh(cached, Request(wikidata.WIKIPEDIA_API, meta={"revid": 136}))
+
+
+def test_html_page_still_cached():
+    policy = WikipediaCachePolicy(Settings())
+    response = fixture_response("movie_full.html", "https://ru.wikipedia.org/wiki/Сталкер_(фильм)")
+    response = HtmlResponse(url=response.url, body=response.body, request=response.request,
+                            headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    assert policy.should_cache_response(response, response.request)
@@ -0,0 +1,27 @@
+from scrapy.http import Request
+
+from movies_parser.imdb_cache import normalize_title
+from movies_parser.items import MoviesParserItem
+from tests.conftest import fixture_response
+
+
+def test_normalize_title():
+    assert normalize_title("  Солярис  (1972) ") == "солярис"
+    assert normalize_title(None) == ""
+    assert normalize_title("") == ""
+
+
+def test_movie_without_infobox_with_cache(make_spider):
+    spider = make_spider(IMDB_CACHE_ENABLED=True, RETRY_POLICY_BUDGETS={"missing_infobox": 0})
+    response = fixture_response("movie_no_infobox.html", "https://ru.wikipedia.org/wiki/Без_инфобокса")
+
+    output = list(spider.parse_movie(response))
+
+    # Оригинального названия нет: ищется только русское, а не None
+    assert len(output) == 1
+    request = output[0]
+    assert isinstance(request, Request)
+    assert "None" not in request.url
+    assert request.cb_kwargs["searches"] == []
+    assert isinstance(request.cb_kwargs["movie"], MoviesParserItem)
+    assert spider.crawler.stats.get_value("imdb_cache/id/miss") == 1
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from movies_parser.middlewares import ProxyPoolMiddleware
+from movies_parser.middlewares import StageTimingSpiderMiddleware
+from movies_parser.spiders.movies import MoviesSpider
+
+
+class SlowSpider(MoviesSpider):
+    def parse_imdb_title(self, response):
+        # Работа при вызове колбэка и при итерации результата
+        time.sleep(0.01)
+        return self.results()
+
+    def results(self):
+        time.sleep(0.01)
+        yield Request("https://www.imdb.com/title/tt0000002/", callback=self.parse_imdb_title)
+
+
+def test_stage_time_excludes_wait_before_callback(make_spider):
+    spider = make_spider(SlowSpider)
+    crawler = spider.crawler
+    middleware = StageTimingSpiderMiddleware(crawler.stats)
+    request = Request("https://www.imdb.com/title/tt0000001/", callback=spider.parse_imdb_title)
+    response = HtmlResponse(request.url, body=b"<html></html>", request=request)
+
+    middleware.process_spider_input(response, spider)
+    # Scrapy вызывает колбэк через callLater, ответ успевает подождать в реакторе
+    time.sleep(0.2)
+    result = response.request.callback(response, **response.request.cb_kwargs)
+    assert response.request.callback == spider.parse_imdb_title
+    output = list(middleware.process_spider_output(response, result, spider))
+
+    assert output[0].callback == spider.parse_imdb_title
+    assert "stage_elapsed" not in output[0].meta
+    total_ms = crawler.stats.get_value("timing/imdb_title/total_ms")
+    assert 20 <= total_ms < 150
+
+
+def test_callback_restored_after_error_before_call(make_spider):
+    spider = make_spider()
+    crawler = spider.crawler
+    middleware = StageTimingSpiderMiddleware(crawler.stats)
+    request = Request("https://ru.wikipedia.org/wiki/X", callback=spider.parse_movie)
+    response = HtmlResponse(request.url, body=b"<html></html>", request=request)
+
+    middleware.process_spider_input(response, spider)
+    middleware.process_spider_exception(response, ValueError(), spider)
+
+    assert response.request.callback == spider.parse_movie
+    assert crawler.stats.get_value("timing/movie_parse/errors") == 1
+
+
+@pytest.mark.parametrize("content", ["", "# прокси закончились\n\n"])
+def test_empty_proxy_list_disables_proxy_pool(tmp_path, content):
+    proxy_list = tmp_path / "proxies.txt"
+    proxy_list.write_text(content, encoding="utf-8")
+    crawler = get_crawler(MoviesSpider, {"PROXY_LIST": str(proxy_list)})
+
+    with pytest.raises(NotConfigured):
+        ProxyPoolMiddleware.from_crawler(crawler)
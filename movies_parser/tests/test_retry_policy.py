@@ -0,0 +1,73 @@
+import json
+
+from scrapy.http import HtmlResponse
+from twisted.internet.error import DNSLookupError
+from twisted.python.failure import Failure
+
+from movies_parser.items import MoviesParserItem
+from movies_parser.items import RatingUpdate
+from movies_parser.pipelines import DuplicatePipeline
+from movies_parser.pipelines import MoviesParserPipeline
+from tests.conftest import FIXTURES_DIR
+from tests.conftest import fixture_response
+
+MOVIE_URL = "https://ru.wikipedia.org/wiki/Несуществующий_фильм"
+
+
+def test_wikipedia_404_goes_to_dead_letter(make_spider, tmp_path):
+    dead_letter = tmp_path / "dead_letter.jsonl"
+    spider = make_spider(RETRY_DEAD_LETTER_FILE=str(dead_letter), CRAWL_STATE_FILE=str(tmp_path / "crawl_state.json"))
+    request = spider.movie_request(MOVIE_URL)
+    spider.crawl_state.add_pending(request.url)
+    # Как у настоящей 404: заголовок статьи есть, инфобокса нет
+    body = (FIXTURES_DIR / "movie_no_infobox.html").read_bytes()
+    response = HtmlResponse(url=request.url, status=404, body=body, encoding="utf-8", request=request)
+
+    assert not list(spider.parse_movie(response) or [])
+
+    stats = spider.crawler.stats
+    assert stats.get_value("retry_policy/not_found/exhausted") == 1
+    assert stats.get_value("retry_policy/missing_infobox/seen") is None
+    [record] = [json.loads(line) for line in dead_letter.read_text(encoding="utf-8").splitlines()]
+    assert record["failure_class"] == "not_found"
+    assert record["callback"] == "parse_movie"
+    assert spider.crawl_state.pending == {}
+
+
+def test_replayed_imdb_request_updates_rating(make_spider, tmp_path):
+    spider = make_spider()
+    spider.replay = str(tmp_path / "dead_letter.jsonl")
+    # Фильм сохранён без рейтинга в прошлом запуске, запрос рейтинга попал в dead-letter
+    spider.titles_seen.add("Сталкер")
+    spider.titles_seen.commit()
+    movie = MoviesParserItem(title="Сталкер", year=1979)
+    response = fixture_response("imdb_title.html", "https://www.imdb.com/title/tt0079944/",
+                                meta={"replay": True}, cb_kwargs={"movie": movie, "searches": []})
+
+    [update] = list(spider.parse_imdb_title(response, **response.request.cb_kwargs))
+
+    assert isinstance(update, RatingUpdate)
+    assert update.imdb_rating
+    # Без INCREMENTAL_RECRAWL обновление не отбрасывается как дубликат, а дописывается в строку
+    duplicates = DuplicatePipeline()
+    duplicates.open_spider(spider)
+    writer = MoviesParserPipeline(spider.crawler.settings)
+    writer.titles_seen = spider.titles_seen
+    assert duplicates.process_item(update, spider) is update
+    writer.process_item(update, spider)
+    assert writer.updates["Сталкер"]["imdb_rating"] == update.imdb_rating
+    assert not writer.buffer
+
+
+def test_failed_first_category_page_goes_to_dead_letter(make_spider, tmp_path):
+    dead_letter = tmp_path / "dead_letter.jsonl"
+    spider = make_spider(RETRY_DEAD_LETTER_FILE=str(dead_letter), RETRY_POLICY_BUDGETS={"download_error": 0})
+    [request] = list(spider.start_requests())
+    failure = Failure(DNSLookupError())
+    failure.request = request
+
+    request.errback(failure)
+
+    [record] = [json.loads(line) for line in dead_letter.read_text(encoding="utf-8").splitlines()]
+    assert record["callback"] == "parse"
+    assert record["failure_class"] == "download_error"
@@ -0,0 +1,68 @@
+import codecs
+
+import pytest
+
+from movies_parser.writers import CsvWriter
+from movies_parser.writers import JsonLinesWriter
+from movies_parser.writers import merge_outputs
+from movies_parser.writers import read_rows
+
+# movies.csv, записанный прежней версией паука (pandas, utf-8-sig)
+BOM_CSV = (
+    "title,original_title,genre,director,country,year,imdb_rating\r\n"
+    "Солярис (фильм),Солярис,драма,Андрей Тарковский,СССР,1972,8.0\r\n"
+    "Сталкер (фильм),Сталкер,драма,Андрей Тарковский,СССР,1979,8.1\r\n"
+)
+
+
+def write_bom_csv(path):
+    path.write_text(BOM_CSV, encoding="utf-8-sig", newline="")
+
+
+def test_upsert_into_bom_csv(tmp_path):
+    path = tmp_path / "movies.csv"
+    write_bom_csv(path)
+
+    writer = CsvWriter(path)
+    writer.upsert({
+        "Сталкер (фильм)": {"title": "Сталкер (фильм)", "imdb_rating": 8.2},
+        "Зеркало (фильм)": {
+            "title": "Зеркало (фильм)", "original_title": "Зеркало", "genre": ("драма",),
+            "director": ("Андрей Тарковский",), "country": ("СССР",), "year": 1974, "imdb_rating": 8.0,
+        },
+    })
+    writer.close()
+
+    assert path.read_bytes().startswith(codecs.BOM_UTF8)
+    rows = {row["title"]: row for row in read_rows(path)}
+    assert list(rows) == ["Солярис (фильм)", "Сталкер (фильм)", "Зеркало (фильм)"]
+    assert rows["Сталкер (фильм)"]["imdb_rating"] == "8.2"
+    assert rows["Сталкер (фильм)"]["year"] == "1979"
+
+
+def test_merge_outputs_reads_bom_csv(tmp_path):
+    source = tmp_path / "node1.csv"
+    write_bom_csv(source)
+
+    assert merge_outputs([source], tmp_path / "merged.csv") == 2
+    assert [row["title"] for row in read_rows(tmp_path / "merged.csv")] == ["Солярис (фильм)", "Сталкер (фильм)"]
+
+
+@pytest.mark.parametrize("writer_cls, name", [(CsvWriter, "movies.csv"), (JsonLinesWriter, "movies.jsonl")])
+def test_update_without_rating_keeps_stored_rating(tmp_path, writer_cls, name):
+    path = tmp_path / name
+    writer = writer_cls(path)
+    writer.write_batch([{
+        "title": "Сталкер (фильм)", "original_title": "Сталкер", "genre": ("драма",),
+        "director": ("Андрей Тарковский",), "country": ("СССР",), "year": 1979, "imdb_rating": 8.1,
+    }])
+    # Статья изменилась и разобрана заново, но рейтинг IMDb в этот раз не получен
+    writer.upsert({"Сталкер (фильм)": {
+        "title": "Сталкер (фильм)", "original_title": "Сталкер", "genre": ("драма", "фантастика"),
+        "director": ("Андрей Тарковский",), "country": ("СССР",), "year": 1979, "imdb_rating": None,
+    }})
+    writer.close()
+
+    [row] = read_rows(path)
+    assert float(row["imdb_rating"]) == 8.1
+    assert "фантастика" in row["genre"]